@@ -0,0 +1,62 @@
+"""Walk a synthetic 100k file tree with ``files.iter_files`` and with a naive ``os.walk`` that filters afterwards.
+
+Run with ``python benchmarks/bench_file_discovery.py [number of files]``.
+"""
+import os
+import pathlib
+import re
+import sys
+import tempfile
+import time
+
+from blacken_docs.files import DEFAULT_EXCLUDES, DEFAULT_INCLUDES, iter_files
+
+INCLUDE = re.compile(DEFAULT_INCLUDES)
+EXCLUDE = re.compile(DEFAULT_EXCLUDES)
+EXTEND_EXCLUDE = re.compile("/node_modules/")
+
+
+def make_tree(root, files):
+    """A third of the files are in directories that are excluded, the rest are spread over docs/."""
+    per_directory = 100
+    for i in range(files // per_directory):
+        if i % 3 == 0:
+            directory = root / ("node_modules" if i % 2 else ".tox") / f"pkg{i}"
+        else:
+            directory = root / "docs" / f"section{i // 10}" / f"page{i}"
+        directory.mkdir(parents=True)
+        for j in range(per_directory):
+            (directory / f"file{j}.{('rst', 'py', 'txt')[j % 3]}").touch()
+    (root / ".gitignore").write_text("*.txt\n")
+
+
+def naive(root):
+    found = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            normalized = "/" + os.path.relpath(os.path.join(directory, name), root).replace(os.sep, "/")
+            if INCLUDE.search(normalized) and not EXCLUDE.search(normalized) and not EXTEND_EXCLUDE.search(normalized):
+                found.append(pathlib.Path(directory, name))
+    return found
+
+
+def main(files=100_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        make_tree(root, files)
+        for name, walk in (
+            ("os.walk + filter", lambda: naive(root)),
+            ("iter_files", lambda: list(iter_files([root], root, INCLUDE, EXCLUDE, EXTEND_EXCLUDE))),
+        ):
+            start = time.perf_counter()
+            found = walk()
+            elapsed = time.perf_counter() - start
+            print(f"{name:>18}: {elapsed * 1000:8.1f} ms, {len(found)} files")
+
+        start = time.perf_counter()
+        next(iter_files([root], root, INCLUDE, EXCLUDE, EXTEND_EXCLUDE))
+        print(f"{'first file after':>18}: {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
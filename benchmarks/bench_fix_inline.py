@@ -0,0 +1,44 @@
+"""Cost of ``formatter.fix_inline`` on large paragraphs against the word by word version it replaced.
+
+Run with ``python benchmarks/bench_fix_inline.py``.
+"""
+import random
+import re
+import textwrap
+import timeit
+
+import corpus
+from blacken_docs import formatter
+
+FIND_NOT_INLINE_TYPES = re.compile(rf"^({'|'.join(formatter.INLINE_WRAPPED_TYPES)})\W?$")
+FIND_INLINE_TYPES = re.compile(rf"^``({'|'.join(formatter.INLINE_WRAPPED_TYPES)})``\W?$")
+
+
+def fix_inline_per_word(string):  # what fix_inline used to do
+    formatted = []
+    for line in string.splitlines(True):
+        for word in line.split(" "):
+            if FIND_NOT_INLINE_TYPES.match(word):  # general match
+                if not FIND_INLINE_TYPES.match(word):  # strict match
+                    word = FIND_NOT_INLINE_TYPES.sub(r"``\1``", word.strip("`"))
+            if formatter.is_not_fully_wrapped(word):  # simple fix
+                word = f"``{word.strip('`')}``"
+            formatted.append(word)
+
+    text = "\n".join(" ".join(formatted).splitlines())
+    return textwrap.dedent(f" {text}")
+
+
+def main(number=20):
+    rng = random.Random(0)
+    for sentences in (10, 100, 1000):
+        paragraph = textwrap.fill(" ".join(corpus._sentence(rng) for _ in range(sentences)), width=88)
+        assert formatter.fix_inline(paragraph) == fix_inline_per_word(paragraph)
+        print(f"{len(paragraph)} characters")
+        for name, func in (("per word", fix_inline_per_word), ("fix_inline", formatter.fix_inline)):
+            elapsed = timeit.timeit(lambda: func(paragraph), number=number)
+            print(f"{name:>16}: {elapsed / number * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
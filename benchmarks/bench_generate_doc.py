@@ -0,0 +1,45 @@
+"""Per-document cost of ``formatter.generate_doc`` against building a fresh Publisher for every call.
+
+Run with ``python benchmarks/bench_generate_doc.py``.
+"""
+import timeit
+
+from docutils import utils
+from docutils.core import Publisher
+
+from blacken_docs import formatter
+
+DOCSTRING = """\
+Return the thing.
+
+Parameters
+----------
+x: int
+    The thing.
+
+.. code-block:: python
+
+    f(1, 2, 3)
+"""
+
+
+def generate_doc_fresh_publisher(content):  # what generate_doc used to do
+    pub = Publisher(None, None, None, settings=None)
+    pub.set_components("standalone", "restructuredtext", "pseudoxml")
+    settings = pub.get_settings(halt_level=5)
+    pub.set_io()
+    document = utils.new_document(None, settings)
+    document.reporter.stream = None
+    pub.reader.parser.parse(content, document)
+    return document
+
+
+def main(number=500):
+    for name, func in (("fresh publisher", generate_doc_fresh_publisher), ("generate_doc", formatter.generate_doc)):
+        func(DOCSTRING)  # warm up
+        elapsed = timeit.timeit(lambda: func(DOCSTRING), number=number)
+        print(f"{name:>16}: {elapsed / number * 1e6:8.1f} us/doc")
+
+
+if __name__ == "__main__":
+    main()
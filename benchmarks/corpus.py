@@ -0,0 +1,102 @@
+"""Deterministic corpus of documents for the benchmarks.
+
+Run with ``python benchmarks/corpus.py DIRECTORY`` to write it out, the benchmarks generate it on the fly otherwise.
+"""
+import pathlib
+import random
+import sys
+import textwrap
+
+WORDS = (
+    "the value of int None returns str a list of the given object when True or False is passed and the "
+    "function raises ValueError if the key is missing from dict otherwise it yields each item in turn"
+).split()
+
+SNIPPETS = (
+    "import os\nimport sys\n",
+    "def f(a,b = 1,*args,**kwargs):\n    return a+b\n",
+    "result = {'key':value for key,value in mapping.items() if value is not None}\n",
+    "class Foo( object ):\n    def bar(self,x):\n        return [ i*2 for i in range(x) ]\n",
+    "with open('file') as f:\n    data=f.read()\n",
+)
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(6, 18))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return textwrap.fill(" ".join(_sentence(rng) for _ in range(rng.randint(2, 6))), width=rng.choice((70, 100, 140)))
+
+
+def rst(rng: random.Random, sections: int) -> str:
+    parts = []
+    for i in range(sections):
+        title = f"Section {i}"
+        parts.append(f"{title}\n{'=' * len(title)}\n")
+        for _ in range(rng.randint(1, 4)):
+            parts.append(_paragraph(rng) + "\n")
+            if rng.random() < 0.6:
+                code = textwrap.indent(rng.choice(SNIPPETS), "    ")
+                parts.append(f".. code-block:: python\n\n{code}")
+    return "\n".join(parts)
+
+
+def numpy_docstrings(rng: random.Random, functions: int) -> str:
+    parts = ['"""Module with numpy style docstrings."""\n']
+    for i in range(functions):
+        doc = textwrap.indent(
+            f"{_sentence(rng)}\n\n"
+            "Parameters\n----------\n"
+            f"x : int\n    {_sentence(rng)}\n"
+            f"y : Optional[str]\n    {_sentence(rng)}\n\n"
+            "Returns\n-------\n"
+            f"bool\n    {_sentence(rng)}\n\n"
+            f".. code-block:: python\n\n{textwrap.indent(rng.choice(SNIPPETS), '    ')}",
+            "    ",
+        ).lstrip()
+        parts.append(f'\n\ndef function_{i}(x, y=None):\n    """{doc}\n    """\n    return x\n')
+    return "".join(parts)
+
+
+def markdown(rng: random.Random, blocks: int) -> str:
+    parts = ["# Title\n"]
+    for _ in range(blocks):
+        parts.append(_paragraph(rng) + "\n")
+        parts.append(f"```python\n{rng.choice(SNIPPETS)}```\n")
+    return "\n".join(parts)
+
+
+def latex(rng: random.Random, blocks: int) -> str:
+    parts = ["\\documentclass{article}\n\\usepackage{minted}\n\\begin{document}\n"]
+    for _ in range(blocks):
+        parts.append(_paragraph(rng) + "\n")
+        parts.append(f"\\begin{{minted}}{{python}}\n{rng.choice(SNIPPETS)}\\end{{minted}}\n")
+    parts.append("\\end{document}\n")
+    return "\n".join(parts)
+
+
+def generate(seed: int = 0) -> dict:
+    """Return the corpus as a mapping of file name to contents, the same for a given ``seed``."""
+    rng = random.Random(seed)
+    corpus = {}
+    for i in range(20):
+        corpus[f"small_{i}.rst"] = rst(rng, sections=2)
+    corpus["large.rst"] = rst(rng, sections=400)
+    for i in range(5):
+        corpus[f"module_{i}.py"] = numpy_docstrings(rng, functions=20)
+    for i in range(5):
+        corpus[f"readme_{i}.md"] = markdown(rng, blocks=20)
+    corpus["book.tex"] = latex(rng, blocks=200)
+    return corpus
+
+
+def write(directory: pathlib.Path, seed: int = 0) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, contents in generate(seed).items():
+        (directory / name).write_text(contents, encoding="UTF-8")
+
+
+if __name__ == "__main__":
+    write(pathlib.Path(sys.argv[1]))
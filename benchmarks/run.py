@@ -0,0 +1,138 @@
+"""Benchmark the formatting pipeline on the corpus from ``corpus.py``.
+
+Run with ``python benchmarks/run.py``, see ``--help`` for the options. Reports per-stage timings (inclusive, so
+``black`` is part of the code blocks time), throughput and peak memory, and can save the numbers as a baseline to
+compare later runs against. Nothing touches the network and the corpus is the same on every run.
+"""
+import argparse
+import collections
+import functools
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+
+import black
+
+import blacken_docs
+import corpus
+from blacken_docs import formatter
+
+MODE = black.FileMode()
+
+# (module, attribute) of the functions timed as stages
+STAGES = {
+    "parse": (formatter, "parse_doc"),
+    "transforms": (formatter, "apply_transforms"),
+    "fix_inline": (formatter, "fix_inline"),
+    "wrap_text": (formatter, "wrap_text"),
+    "is_python": (formatter, "is_python"),
+    "code_blocks": (formatter, "blacken_code_blocks_many"),
+    "black": (black, "format_str"),
+}
+
+
+def _timed(func, stage, timings):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+
+    return wrapper
+
+
+def load_corpus(directory):
+    if directory is None:
+        return corpus.generate()
+    return {path.name: path.read_text(encoding="UTF-8") for path in sorted(directory.iterdir()) if path.is_file()}
+
+
+def run_once(documents):
+    formatter.block_cache.clear()  # every run should do the same amount of work
+    start = time.perf_counter()
+    for name, contents in documents.items():
+        blacken_docs.format_contents(contents, mode=MODE, path=pathlib.Path(name))
+    return time.perf_counter() - start
+
+
+def measure(documents, repeat):
+    originals = {stage: getattr(module, attribute) for stage, (module, attribute) in STAGES.items()}
+    best_stages = {}
+    best_total = float("inf")
+    for _ in range(repeat):
+        timings = collections.defaultdict(float)
+        for stage, (module, attribute) in STAGES.items():
+            setattr(module, attribute, _timed(originals[stage], stage, timings))
+        try:
+            total = run_once(documents)
+        finally:
+            for stage, (module, attribute) in STAGES.items():
+                setattr(module, attribute, originals[stage])
+        if total < best_total:
+            best_total, best_stages = total, dict(timings)
+
+    tracemalloc.start()
+    run_once(documents)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size = sum(len(contents.encode("UTF-8")) for contents in documents.values())
+    return {
+        "files": len(documents),
+        "bytes": size,
+        "total_seconds": best_total,
+        "files_per_second": len(documents) / best_total,
+        "bytes_per_second": size / best_total,
+        "peak_memory_bytes": peak,
+        "stages": best_stages,
+    }
+
+
+def print_results(results, baseline=None):
+    def line(name, value, old, unit):
+        change = f"  ({(value - old) / old:+.1%})" if old else ""
+        print(f"{name:>22}: {value:14.3f} {unit}{change}")
+
+    baseline = baseline or {}
+    print(f"{results['files']} files, {results['bytes']} bytes")
+    line("total", results["total_seconds"], baseline.get("total_seconds"), "s")
+    line("files/sec", results["files_per_second"], baseline.get("files_per_second"), "")
+    line("bytes/sec", results["bytes_per_second"], baseline.get("bytes_per_second"), "")
+    old_peak = baseline.get("peak_memory_bytes")
+    line("peak memory", results["peak_memory_bytes"] / 2 ** 20, old_peak and old_peak / 2 ** 20, "MiB")
+    for stage in STAGES:
+        old = baseline.get("stages", {}).get(stage)
+        line(stage, results["stages"].get(stage, 0.0), old, "s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=pathlib.Path, help="directory of documents, generated if not given")
+    parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of (default: %(default)s)")
+    parser.add_argument("--save", type=pathlib.Path, help="write the results as a baseline to this file")
+    parser.add_argument("--compare", type=pathlib.Path, help="compare against a baseline written by --save")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.1,
+        help="with --compare, exit with 1 if the total time grew by more than this fraction (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    results = measure(load_corpus(args.corpus), args.repeat)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_results(results, baseline)
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+    if baseline and results["total_seconds"] > baseline["total_seconds"] * (1 + args.max_regression):
+        print(f"total time regressed by more than {args.max_regression:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,119 @@
 # -*- coding: utf-8 -*-
 
-import importlib
+import collections
+import filecmp
 import inspect
+import io
+import itertools
+import json
 import pathlib
+import sys
 import re
 import textwrap
+import tokenize
 import traceback
-from types import FunctionType
-from typing import List, NamedTuple, Set, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
 import black
 import click
-import restructuredtext_lint
 from docutils import nodes
-from docutils.nodes import system_message
 
-from blacken_docs.formatter import blacken_code_blocks, fix_inline, wrap_text
+from blacken_docs import stats
+from blacken_docs.cache import Cache, SectionIndex
+from blacken_docs.docstrings import find_docstrings, splice
+from blacken_docs.doctests import is_doctest
+from blacken_docs.changes import GitError, LineRanges, changed_lines, intersects
+from blacken_docs.files import DEFAULT_EXCLUDES, DEFAULT_INCLUDES, is_included, iter_files
+from blacken_docs.formatter import CodeBlockError, fix_inline, iter_lines, wrap_text
+from blacken_docs.latex import LATEX_SUFFIXES, format_latex, iter_latex
+from blacken_docs.markdown import MARKDOWN_SUFFIXES, format_markdown, iter_markdown
+from blacken_docs.output import replace, temporary_sibling, unified_diff, write_atomic
+from blacken_docs.sections import iter_sections
 
+__version__ = "1.7.0"
+DEFAULT_STREAM_THRESHOLD = 16 * 2 ** 20  # bytes
 
-class CodeBlockError(NamedTuple):
-    line_number: int
-    src: str
-    exc: Exception
 
+class FileResult(NamedTuple):
+    path: pathlib.Path
+    changed: black.Changed
+    output: List[str]  # lines for stdout, printed by the parent process
+    failures: List[str]
+    timings: Optional[stats.Stats] = None  # only collected when asked for
+    content: Optional[str] = None  # formatted, blocks with errors left as they were, None for streamed and cached files
+    errors: Sequence[CodeBlockError] = ()
 
-def format_str(src: str, *, mode: black.FileMode,) -> Tuple[str, List[CodeBlockError]]:
+
+class Source(NamedTuple):
+    """A document to format from memory, ``path`` picks the formatter and nothing is read from or written to it."""
+
+    path: pathlib.Path
+    content: str
+
+
+class _PendingBlock(NamedTuple):
+    index: int  # of the block's result in the batch
+    text: str
+    is_literal: bool  # literal blocks have to be code, anything else falls back to being prose
+    line: Optional[int] = None  # docutils' line of the node, at or after the first line of the block
+
+
+def _find_block(source_lines: Sequence[str], block: str, hint: Optional[int]) -> Optional[int]:
+    """The line ``block`` starts on, searching back from ``hint`` as docutils puts the line of some nodes after it."""
+    first = block.split("\n", 1)[0]
+    for number in range(min(hint or len(source_lines), len(source_lines)), 0, -1):
+        line = source_lines[number - 1]
+        if line.endswith(first) and not line[: len(line) - len(first)].strip():
+            return number
+    return None
+
+
+def format_str(
+    src: str, *, mode: black.FileMode, executor: Optional[Executor] = None, transforms: bool = True,
+) -> Tuple[str, List[CodeBlockError]]:
+    """Format reStructuredText, ``transforms=False`` skips the checks that need the whole document like references."""
+    formatted, errors = _format_str(src, mode=mode, executor=executor, transforms=transforms)
+    return formatted if errors else formatted.strip(), errors
+
+
+def _format_str(
+    src: str, *, mode: black.FileMode, executor: Optional[Executor], transforms: bool
+) -> Tuple[str, List[CodeBlockError]]:
     errors: List[CodeBlockError] = []
     try:
-        for error in restructuredtext_lint.lint(src):
-            errors.append(CodeBlockError(error.line, error.astext(), Exception()))
-        if errors:  # don't proceed further
-            return src, errors
+        with stats.timer("parse"):
+            doc, messages = formatter.parse_doc(src)
 
-        doc = formatter.generate_doc(src)
+        blocks: List[str] = []  # code blocks found in the tree, formatted together once it has all been read
+        source_lines: List[str] = []  # split once a title or the first error needs them
 
-        def recursive_iter(doc: Union[nodes.document]):
-            ret = []
-            for child in doc.children:
-                text: str = child.astext()
+        def section_title(title: nodes.title) -> str:
+            """The title as it is in the source with its adornment, so the sections are still there once written."""
+            if not source_lines:
+                source_lines.extend(src.splitlines())
+            text, character, overline = title.astext(), "=", False
+            line = title.line or 0  # docutils' line of a title is its underline
+            underline = source_lines[line - 1].strip() if 2 <= line <= len(source_lines) else ""
+            if underline:
+                text, character = source_lines[line - 2].strip(), underline[0]
+                overline = line > 2 and source_lines[line - 3].strip().startswith(character)
+            adornment = character * len(text)
+            return f"\n{adornment}\n{text}\n{adornment}\n" if overline else f"\n{text}\n{adornment}\n"
+
+        def recursive_iter(doc: Union[nodes.document, nodes.section]) -> List[Union[str, list, _PendingBlock]]:
+            ret: List[Union[str, list, _PendingBlock]] = []
+            children = doc.children
+            if isinstance(doc, nodes.section) and children and isinstance(children[0], nodes.title):
+                ret.append(section_title(children[0]))
+                children = children[1:]
+            for child in children:
+                text: Union[str, list, _PendingBlock] = child.astext()
                 # print("top level", child.__class__, repr(child), repr(text))
 
-                if isinstance(child, nodes.section):  # iter over its children
-                    for grand_child in child.children:
-                        text = recursive_iter(grand_child)
-                        ret.append(text)
+                if isinstance(child, nodes.section):  # its body is formatted like the document's
+                    ret.append(recursive_iter(child))
                     continue
                 elif isinstance(child, nodes.definition_list_item):
                     # definition_list_item is the param type like Optional[int] ...
@@ -56,58 +126,193 @@ def format_str(src: str, *, mode: black.FileMode,) -> Tuple[str, List[CodeBlockE
                 elif isinstance(child, nodes.Text):
                     if text in formatter.POSSIBLE_TITLES:
                         text = f'{text}\n{"-" * (len(text) + 1)}'
-                    else:  # gonna assume its a codeblock
-                        try:
-                            text = blacken_code_blocks(text, mode=mode)
-                            # needs to check append " ::\n" to the previous element TODO
-                        except black.InvalidInput:
-                            # likely not a code block need to find a better way to do this TODO
-                            text = formatter.wrap_and_fix(text, mode=mode)
+                    elif is_doctest(text) or formatter.is_python(text):  # gonna assume its a codeblock
+                        # needs to check append " ::\n" to the previous element TODO
+                        blocks.append(text)
+                        text = _PendingBlock(len(blocks) - 1, text, is_literal=False)
+                    else:  # likely not a code block need to find a better way to do this TODO
+                        text = formatter.wrap_and_fix(text, mode=mode)
+
+                elif isinstance(child, nodes.doctest_block):  # not indented, or it would become a block quote
+                    text = formatter.format_doctest(text, mode=mode)
 
                 elif isinstance(child, nodes.literal_block):  # code block
-                    text = blacken_code_blocks(text, mode=mode)
+                    blocks.append(text)
+                    text = _PendingBlock(len(blocks) - 1, text, is_literal=True, line=child.line)
 
                 elif isinstance(child, nodes.paragraph):
                     text = formatter.wrap_and_fix(text, mode=mode)
                 ret.append(text)
+            return ret
+
+        def literal_block_error(block: _PendingBlock, exc: Exception) -> CodeBlockError:
+            if not source_lines:
+                source_lines.extend(src.splitlines())
+            start = _find_block(source_lines, block.text, block.line)
+            if start is None:
+                return CodeBlockError(block.line or 1, block.text, exc)
+            dedented = block.text.split("\n")
+            lines = source_lines[start - 1 : start - 1 + len(dedented)]
+            return formatter.block_error(exc, src=block.text, lines=lines, dedented=dedented, line_number=start)
+
+        def render(parts: List[Union[str, list, _PendingBlock]]) -> str:
+            ret = []
+            for part in parts:
+                if isinstance(part, list):
+                    part = render(part)
+                elif isinstance(part, _PendingBlock):
+                    result = formatted[part.index]
+                    if isinstance(result, str):
+                        part = result
+                    elif part.is_literal:
+                        errors.append(literal_block_error(part, result))
+                        part = part.text
+                    else:  # it compiles but black can't parse it
+                        part = formatter.wrap_and_fix(part.text, mode=mode)
+                ret.append(part)
             return "\n".join(ret)
 
-        ret = recursive_iter(doc)
-    except Exception as exc:
-        traceback.print_exc()
-        errors.append(CodeBlockError(exc.__traceback__.tb_lineno, src, exc))
-    finally:
-        return ret.strip(), errors
+        if not messages:
+            with stats.timer("walk"):
+                parts = recursive_iter(doc)
+                formatted = formatter.blacken_code_blocks_many(blocks, mode=mode, executor=executor)
+                ret = render(parts)
+            # transforms restructure the tree, so they can only run once we're done reading it
+            if transforms:
+                with stats.timer("transforms"):
+                    messages = formatter.apply_transforms(doc)
+        for message in messages:
+            errors.append(CodeBlockError(message.get("line"), message.astext(), Exception()))
+        if errors:  # don't proceed further
+            return src, errors
+    except Exception as exc:  # a bug rather than a problem with the document, reported as an error all the same
+        errors.append(CodeBlockError(getattr(exc, "lineno", None) or 1, src, exc))
+        return src, errors
+    return ret, errors
 
 
-def format_py_file(path: pathlib.Path, *, mode: black.Mode, report: black.Report):
-    path = path.as_posix()
-    file = importlib.import_module(path)
-    original = open(path).read()
+def format_py_str(
+    src: str, *, mode: black.FileMode, lines: Optional[LineRanges] = None,
+) -> Tuple[str, List[CodeBlockError]]:
+    """Format the code in ``src`` with black, then the reStructuredText in every docstring.
 
-    def format_object(obj: object, indent: int):
-        black.reformat_one(
-            src=path, fast=False, write_back=black.WriteBack.YES, mode=mode, report=report,
-        )
-        for _, attr in inspect.getmembers(obj):
-            format_object(attr, indent + 4)
-        to_format = inspect.getdoc(obj)
-        formatted = format_str(to_format, mode=mode)
-        current = open(path).read()
-        search = re.search(rf'{obj.__name__}.*:\s+"""(.*)"""', current, re.S)
-        final = textwrap.indent(textwrap.dedent(formatted), prefix=" " * indent).strip()
-        to_write = current.replace(search.group(1), final)
-        open(path, "w+").write(to_write)
-
-    for _, attr in inspect.getmembers(file):  # needs to be recursive
-        if isinstance(attr, FunctionType):
-            format_object(attr, indent=4)
-        elif inspect.isclass(attr):
-            format_object(attr, indent=4)
-
-    new = open(path).read()
-    open(path, "w+").write(original)
-    return new
+    The source is never imported. With ``lines`` only the docstrings overlapping them are formatted and the code
+    is left alone, so lines outside of them don't change.
+    """
+    if lines is None:
+        try:
+            with stats.timer("black_file"):
+                src = black.format_file_contents(src, fast=False, mode=mode)
+        except black.NothingChanged:
+            pass
+        except Exception as exc:
+            position = formatter.error_position(exc)
+            if position is None:
+                return src, [CodeBlockError(getattr(exc, "lineno", None) or 1, src, exc)]
+            return src, [CodeBlockError(position[0], src, exc, position[1] + 1)]
+    try:
+        with stats.timer("docstrings"):
+            docstrings = find_docstrings(src)
+    except (SyntaxError, tokenize.TokenError) as exc:
+        return src, [CodeBlockError(getattr(exc, "lineno", 1), src, exc)]
+
+    errors: List[CodeBlockError] = []
+    replacements = []
+    for docstring in docstrings:
+        if lines is not None and not intersects(docstring.lineno, docstring.end_lineno, lines):
+            continue
+        body = docstring.body
+        if "\\" in body:
+            continue  # escapes would be spliced back as they are, raw or not the docstring's value would change
+        leading = body[: len(body) - len(body.lstrip())]
+        trailing = body[len(body.rstrip()) :] if body.strip() else ""
+        formatted, doc_errors = format_str(inspect.cleandoc(body), mode=mode)
+        if doc_errors:
+            first_line = docstring.lineno + leading.count("\n") - 1
+            errors.extend(
+                error._replace(line_number=first_line + error.line_number, column=docstring.indent + error.column)
+                if isinstance(error.line_number, int)
+                else error
+                for error in doc_errors
+            )
+            continue
+        new_body = leading + textwrap.indent(formatted, prefix=" " * docstring.indent).strip() + trailing
+        if docstring.quote in new_body or new_body.endswith(docstring.quote[0]):
+            continue  # can't be put back without escaping
+        if len(docstring.quote) == 1 and "\n" in new_body:
+            continue  # a single quoted string can't span lines
+        if new_body != body:
+            replacements.append((docstring, new_body))
+    return splice(src, replacements), errors
+
+
+def format_py_file(
+    path: pathlib.Path, *, mode: black.Mode, lines: Optional[LineRanges] = None,
+) -> Tuple[str, List[CodeBlockError]]:
+    with open(path, encoding="UTF-8") as f:
+        return format_py_str(f.read(), mode=mode, lines=lines)
+
+
+def format_contents(
+    contents: str,
+    *,
+    mode: black.FileMode,
+    path: Optional[pathlib.Path] = None,
+    lines: Optional[LineRanges] = None,
+    index: Optional[SectionIndex] = None,
+) -> Tuple[str, List[CodeBlockError]]:
+    """Format ``contents`` with the formatter for ``path``'s file type without touching the disk.
+
+    With an ``index`` reStructuredText is formatted a top-level section at a time, only the sections that aren't in
+    it already are formatted and then added to it.
+    """
+    if path is not None and path.name.endswith(".py"):
+        return format_py_str(contents, mode=mode, lines=lines)
+    if path is not None and path.suffix in MARKDOWN_SUFFIXES:
+        return format_markdown(contents, mode=mode, lines=lines)
+    if path is not None and path.suffix in LATEX_SUFFIXES:
+        return format_latex(contents, mode=mode, lines=lines)
+    if index is not None:
+        errors: List[CodeBlockError] = []
+        formatted = "".join(iter_rst_sections(iter_lines(contents), mode=mode, errors=errors, index=index))
+        return contents if errors else formatted, errors
+    return format_str(contents, mode=mode)
+
+
+def iter_rst_sections(
+    lines: Iterable[str],
+    *,
+    mode: black.FileMode,
+    errors: List[CodeBlockError],
+    index: Optional[SectionIndex] = None,
+) -> Iterator[str]:
+    """Yield the top-level sections of ``lines`` formatted, together the same as :func:`format_str` of all of them.
+
+    Sections are formatted on their own, so references between them aren't checked. Sections found in ``index``
+    aren't formatted again.
+    """
+    whitespace = ""  # held back until there is more text, as format_str strips the ends of the document
+    started = False
+    for number, (lineno, section) in enumerate(iter_sections(lines)):
+        formatted = index.get(section) if index is not None else None
+        if formatted is None:
+            formatted, section_errors = _format_str(section, mode=mode, executor=None, transforms=False)
+            errors.extend(
+                error._replace(line_number=lineno + (error.line_number or 1) - 1) for error in section_errors
+            )
+            if index is not None and not section_errors:
+                index.add(section, formatted)
+                index.add(formatted, formatted)  # what the section is once it's written back
+        for text in ("\n", formatted) if number else (formatted,):
+            if not started:
+                text = text.lstrip()
+            body = text.rstrip()
+            if body:
+                yield whitespace + body
+                whitespace = text[len(body) :]
+                started = True
+            else:
+                whitespace += text
 
 
 def format_rst_file(path: pathlib.Path, *, mode: black.Mode):
@@ -115,48 +320,386 @@ def format_rst_file(path: pathlib.Path, *, mode: black.Mode):
     return format_str(original, mode=mode)
 
 
-def format_file(file: pathlib.Path, mode: black.FileMode, report: black.Report,) -> int:
-    with open(file, encoding="UTF-8") as f:
+def _should_stream(file: pathlib.Path, stream_threshold: Optional[int]) -> bool:
+    return stream_threshold is not None and not file.name.endswith(".py") and file.stat().st_size > stream_threshold
+
+
+def _format_file(
+    file: pathlib.Path,
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[LineRanges] = None,
+    collect_stats: bool = False,
+    stream_threshold: Optional[int] = None,
+    preserve_mtime: bool = False,
+    incremental: bool = False,
+) -> FileResult:
+    """Format a single file without touching any shared state, so it can run in a worker process.
+
+    Files other than .py files bigger than ``stream_threshold`` bytes are streamed through a temporary file.
+    With ``diff`` the file isn't written, the result's output is a unified diff of the changes instead.
+    With ``incremental`` only the sections of reStructuredText files that changed since the last run are formatted.
+    """
+    format_file_contents = partial(
+        _format_file_streaming if _should_stream(file, stream_threshold) else _format_file_contents,
+        file,
+        mode,
+        check=check,
+        diff=diff,
+        lines=lines,
+        preserve_mtime=preserve_mtime,
+        incremental=incremental,
+    )
+    if not collect_stats:
+        return format_file_contents()
+    with stats.collect() as file_stats, stats.timer("file"):
+        result = format_file_contents()
+    return result._replace(timings=file_stats)
+
+
+def _format_file_streaming(
+    file: pathlib.Path,
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[LineRanges] = None,
+    preserve_mtime: bool = False,
+    incremental: bool = False,
+) -> FileResult:
+    """:func:`_format_file_contents` for huge files, only one section or code block is in memory at a time.
+
+    The output goes to a temporary file next to ``file`` which replaces it once everything has been formatted.
+    """
+    errors: List[CodeBlockError] = []
+    index = _section_index(file, mode) if incremental else None
+    with temporary_sibling(file) as (fd, tmp):
+        with open(fd, "w", encoding="UTF-8") as dst, open(file, encoding="UTF-8") as src:
+            if file.suffix in MARKDOWN_SUFFIXES:
+                chunks = iter_markdown(src, mode=mode, errors=errors, ranges=lines)
+            elif file.suffix in LATEX_SUFFIXES:
+                chunks = iter_latex(src, mode=mode, errors=errors, ranges=lines)
+            else:
+                chunks = iter_rst_sections(src, mode=mode, errors=errors, index=index)
+            for chunk in chunks:
+                dst.write(chunk)
+            if index is not None:
+                index.write()
+        failures = [_failure(file, error) for error in errors]
+        if errors or filecmp.cmp(file, tmp, shallow=False):
+            return FileResult(file, black.Changed.NO, [], failures, errors=errors)
+        if diff:
+            with open(file, encoding="UTF-8") as a, open(tmp, encoding="UTF-8") as b:
+                return FileResult(file, black.Changed.YES, [_diff(file, a, b)], [])
+        if check:
+            return FileResult(file, black.Changed.YES, [], [])
+        replace(tmp, file, preserve_mtime=preserve_mtime)
+        return FileResult(file, black.Changed.YES, [f"{file}: Rewriting..."], [])
+
+
+def _format_file_contents(
+    file: pathlib.Path,
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[LineRanges] = None,
+    preserve_mtime: bool = False,
+    incremental: bool = False,
+) -> FileResult:
+    with stats.timer("read"), open(file, encoding="UTF-8") as f:
         original = f.read()
+    result, new_contents = _format_original(
+        file, original, mode, check=check, diff=diff, lines=lines, incremental=incremental
+    )
+    if new_contents is None:
+        return result
+    with stats.timer("write"):
+        return _write_result(result, new_contents, preserve_mtime=preserve_mtime)
+
+
+def _format_original(
+    file: pathlib.Path,
+    original: str,
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[LineRanges] = None,
+    incremental: bool = False,
+) -> Tuple[FileResult, Optional[str]]:
+    """Format the contents of ``file``, returning the result and the new contents if they should be written."""
+    index = _section_index(file, mode) if incremental else None
+    new_contents, errors = format_contents(original, mode=mode, path=file, lines=lines, index=index)
+    if index is not None:
+        index.write()
+    return _file_result(file, original, new_contents, errors, check=check, diff=diff)
+
+
+def _section_index(file: pathlib.Path, mode: black.FileMode) -> Optional[SectionIndex]:
+    """The :class:`SectionIndex` of ``file``, ``None`` unless it's formatted as reStructuredText."""
+    if file.name.endswith(".py") or file.suffix in MARKDOWN_SUFFIXES or file.suffix in LATEX_SUFFIXES:
+        return None
+    return SectionIndex.read(file, mode)
 
-    if file.name.endswith(".py"):
-        new_contents, errors = format_py_file(file, mode=mode, report=report)
+
+def _failure(file: pathlib.Path, error: CodeBlockError) -> str:
+    return f"{file}:{error.line_number}:{error.column}: code block parse error {error.exc}"
+
+
+def _file_result(
+    file: pathlib.Path, original: str, new_contents: str, errors: List[CodeBlockError], *, check: bool, diff: bool
+) -> Tuple[FileResult, Optional[str]]:
+    """The result of formatting ``file`` and the new contents if they should be written."""
+    output: List[str] = []
+    failures = [_failure(file, error) for error in errors]
+    result = FileResult(file, black.Changed.NO, output, failures, content=new_contents, errors=errors)
+    if errors or original == new_contents:
+        return result, None
+    result = result._replace(changed=black.Changed.YES)
+    if diff:
+        output.append(_diff(file, io.StringIO(original), io.StringIO(new_contents)))
+    elif not check:
+        output.append(f"{file}: Rewriting...")
+        return result, new_contents
+    return result, None
+
+
+def _write_result(result: FileResult, new_contents: str, *, preserve_mtime: bool = False) -> FileResult:
+    try:
+        write_atomic(result.path, new_contents, preserve_mtime=preserve_mtime)
+    except Exception:
+        return result._replace(failures=[*result.failures, traceback.format_exc(limit=1)])
+    return result
+
+
+def _diff(file: pathlib.Path, original: Iterable[str], formatted: Iterable[str]) -> str:
+    with stats.timer("diff"):
+        return "".join(unified_diff(original, formatted, str(file), str(file))).rstrip("\n")
+
+
+def _report_result(
+    result: FileResult, report: black.Report, error_records: Optional[List[Dict[str, Any]]] = None
+) -> int:
+    """Print ``result`` and count it in ``report``, with ``error_records`` its failures are added to it instead."""
+    for line in result.output:
+        print(line, file=sys.stdout if error_records is None else sys.stderr)
+    if error_records is None:
+        for failure in result.failures:
+            report.failed(result.path, failure)
     else:
-        new_contents, errors = format_rst_file(file, mode=mode)
+        error_records.extend(_error_records(result.path, result.errors, result.failures))
+        report.failure_count += len(result.failures)
+    if result.failures:
+        return 1
+    report.done(result.path, result.changed)
+    return 0
+
 
-    for error in errors:
-        lineno = original.count(error.src) + 1
-        report.failed(file, f"{file}:{lineno}: code block parse error {error.exc}")
+def _error_records(
+    path: pathlib.Path, errors: Sequence[CodeBlockError], failures: Sequence[str]
+) -> List[Dict[str, Any]]:
+    """``--error-format json`` records of the failures, the ones that aren't about a code block have no position."""
     if errors:
-        return 1
-    if original != new_contents and not report.check:
-        print(f"{file}: Rewriting...")
-        with open(file, "w", encoding="UTF-8") as f:
-            try:
-                f.write(new_contents)
-            except Exception:
-                report.failed(file, traceback.format_exc(limit=1))
+        return [
+            {"path": str(path), "line": e.line_number, "column": e.column, "message": str(e.exc) or e.src}
+            for e in errors
+        ]
+    return [{"path": str(path), "line": None, "column": None, "message": failure} for failure in failures]
+
+
+def format_file(file: pathlib.Path, mode: black.FileMode, report: black.Report,) -> int:
+    result = _format_file(file, mode, check=report.check, diff=report.diff)
+    return _report_result(result, report)
+
+
+def _process_pool(workers: int) -> Executor:
+    if sys.platform == "win32":
+        # Work around https://bugs.python.org/issue26903
+        workers = min(workers, 61)
+    try:
+        from concurrent.futures import ProcessPoolExecutor  # imports multiprocessing, not worth it for one worker
+
+        return ProcessPoolExecutor(max_workers=workers)
+    except (ImportError, OSError):
+        # multiprocessing isn't supported everywhere (AWS Lambda, Termux), fall back to a single thread
+        return ThreadPoolExecutor(max_workers=1)
+
+
+def _format_source(
+    source: Union[pathlib.Path, Source],
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[LineRanges] = None,
+    collect_stats: bool = False,
+    stream_threshold: Optional[int] = None,
+    preserve_mtime: bool = False,
+    incremental: bool = False,
+) -> FileResult:
+    if isinstance(source, pathlib.Path):
+        return _format_file(
+            source,
+            mode,
+            check=check,
+            diff=diff,
+            lines=lines,
+            collect_stats=collect_stats,
+            stream_threshold=stream_threshold,
+            preserve_mtime=preserve_mtime,
+            incremental=incremental,
+        )
+    format_original = partial(_format_original, source.path, source.content, mode, check=True, diff=diff, lines=lines)
+    if not collect_stats:
+        return format_original()[0]
+    with stats.collect() as file_stats, stats.timer("file"):
+        result, _ = format_original()
+    return result._replace(timings=file_stats)
+
+
+def format_many(
+    sources: Iterable[Union[pathlib.Path, Source]],
+    mode: black.FileMode,
+    *,
+    check: bool = False,
+    diff: bool = False,
+    workers: int = 1,
+    cache: Optional[Cache] = None,
+    lines: Optional[Dict[pathlib.Path, Optional[LineRanges]]] = None,
+    collect_stats: bool = False,
+    stream_threshold: Optional[int] = None,
+    preserve_mtime: bool = False,
+    incremental: bool = False,
+    in_order: bool = False,
+) -> Iterator[FileResult]:
+    """Format ``sources`` in a pool of ``workers`` processes, yielding the results as they are done.
+
+    Files are written back unless ``check`` or ``diff`` is given, :class:`Source` documents never are, the formatted
+    text is in the result's ``content`` either way. Sources already formatted according to ``cache`` are skipped
+    with a result that is ``black.Changed.CACHED``, which only has the ``content`` of :class:`Source` documents as
+    cached files aren't read. The others are added to the cache once they are formatted, writing it back is up to
+    the caller. ``sources`` is only read as the workers need more, so it can be a lazy directory walk.
+    With ``in_order`` the results are yielded in the order of ``sources`` instead.
+    """
+    with _process_pool(workers) as executor:
+        worker = partial(
+            _format_source,
+            mode=mode,
+            check=check,
+            diff=diff,
+            collect_stats=collect_stats,
+            stream_threshold=stream_threshold,
+            preserve_mtime=preserve_mtime,
+            incremental=incremental,
+        )
+        sources = iter(sources)
+        futures: Dict["Future[FileResult]", Union[pathlib.Path, Source]] = {}  # in the order they were submitted
+        while True:
+            for source in itertools.islice(sources, max(workers * 2 - len(futures), 0)):
+                if cache is not None and _is_cached(source, cache):
+                    future: "Future[FileResult]" = Future()
+                    content = source.content if isinstance(source, Source) else None
+                    future.set_result(FileResult(_path(source), black.Changed.CACHED, [], [], content=content))
+                else:
+                    future = executor.submit(worker, source, lines=(lines or {}).get(_path(source)))
+                futures[future] = source
+            if not futures:
+                return
+            if in_order:
+                done: Iterable["Future[FileResult]"] = [next(iter(futures))]
             else:
-                report.done(file, black.Changed.YES)
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    result = FileResult(_path(source), black.Changed.NO, [], [str(exc)])
+                if (
+                    cache is not None
+                    and result.changed is not black.Changed.CACHED
+                    and not result.failures
+                    and (lines or {}).get(_path(source)) is None  # only part of it was formatted otherwise
+                ):
+                    _mark_cached(source, result, cache, check=check or diff)
+                yield result
+
+
+def _path(source: Union[pathlib.Path, Source]) -> pathlib.Path:
+    return source if isinstance(source, pathlib.Path) else source.path
+
+
+def _is_cached(source: Union[pathlib.Path, Source], cache: Cache) -> bool:
+    if isinstance(source, pathlib.Path):
+        return cache.is_formatted(source)
+    return cache.is_formatted_contents(source.content, source.path)
+
+
+def _mark_cached(source: Union[pathlib.Path, Source], result: FileResult, cache: Cache, *, check: bool) -> None:
+    if isinstance(source, Source):
+        if result.content is not None:
+            cache.mark_formatted_contents(result.content, source.path)
+    elif not check or result.changed is black.Changed.NO:  # only files that are now formatted on disk
+        cache.mark_formatted(source)
+
 
-    elif original != new_contents and report.check and report.diff:
-        report.done(file, black.Changed.YES)
+def format_stdin(
+    mode: black.FileMode, report: black.Report, path: Optional[pathlib.Path] = None, *, error_format: str = "text"
+) -> None:
+    """Format stdin to stdout, without looking at the filesystem. JSON errors go to stderr."""
+    src = click.get_text_stream("stdin").read()
+    try:
+        dst, errors = format_contents(src, mode=mode, path=path)
+    except Exception as exc:
+        dst, errors = src, [CodeBlockError(0, src, exc)]
+    if not report.check:
+        click.echo(dst, nl=False)
+    if error_format == "json":
+        click.echo(json.dumps(_error_records(pathlib.Path("-"), errors, []), indent=2), err=True)
+        report.failure_count += len(errors)
     else:
-        report.done(file, black.Changed.NO)
+        for error in errors:
+            message = str(error.exc) or error.src
+            report.failed(pathlib.Path("-"), f"{error.line_number}:{error.column}: code block parse error {message}")
+    if not errors:
+        report.done(pathlib.Path("-"), black.Changed.YES if dst != src else black.Changed.NO)
 
 
 def recursive_file_finder(path: pathlib.Path) -> Set[pathlib.Path]:
-    ret = set()
-    for f in path.iterdir():
-        if not f.name.endswith((".rst", ".py")):
-            continue
-        if f.is_dir():
-            ret.update(recursive_file_finder(f))
-        elif f.is_file():
-            ret.add(f)
+    return set(iter_files([path], path, re.compile(DEFAULT_INCLUDES), re.compile(DEFAULT_EXCLUDES)))
+
+
+class _ThreadReport(black.Report):
+    """A report for the file walk running in another thread, its calls are replayed on ``report`` by :meth:`flush`.
+
+    ``black.Report`` counts and prints, which has to happen in the thread reporting the results.
+    """
+
+    def __init__(self, report: black.Report):
+        super().__init__(check=report.check, diff=report.diff, quiet=report.quiet, verbose=report.verbose)
+        self.report = report
+        self.calls: "collections.deque[partial[None]]" = collections.deque()  # appending and popping are atomic
+
+    def done(self, src: pathlib.Path, changed: black.Changed) -> None:
+        self.calls.append(partial(self.report.done, src, changed))
+
+    def path_ignored(self, path: pathlib.Path, message: str) -> None:
+        self.calls.append(partial(self.report.path_ignored, path, message))
+
+    def flush(self) -> None:
+        while self.calls:
+            self.calls.popleft()()
+
+
+def _filter_cached(sources: Iterable[pathlib.Path], cache: Cache, report: black.Report) -> Iterator[pathlib.Path]:
+    for path in sources:
+        if cache.is_formatted(path):
+            report.done(path, black.Changed.CACHED)
         else:
-            black.err(f"invalid path: {f}")
-    return ret
+            yield path
 
 
 @click.command(context_settings=dict(help_option_names=["-h", "--help"]))
@@ -191,12 +734,129 @@ def recursive_file_finder(path: pathlib.Path) -> Set[pathlib.Path]:
 @click.option(
     "--diff", is_flag=True, help="Don't write the files back, just output a diff for each file on stdout.",
 )
+@click.option(
+    "--diff-only",
+    is_flag=True,
+    help="Like --diff, but write nothing else to stdout, so the output can be piped to patch or git apply.",
+)
+@click.option(
+    "--preserve-mtime", is_flag=True, help="Keep the modification time of the files that are rewritten.",
+)
+@click.option(
+    "-W",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes used to format files in parallel.",
+    show_default=True,
+)
+@click.option(
+    "--async-io",
+    is_flag=True,
+    help="Read and write files in background threads while others are formatted, for slow or network filesystems.",
+)
+@click.option(
+    "--no-daemon", is_flag=True, help="Format the files in this process even if a blacken-docs-daemon is running.",
+)
+@click.option(
+    "--no-cache", is_flag=True, help="Don't read or write the cache of already formatted files.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help=(
+        "Only format the top-level sections of reStructuredText files that changed since the last run, remembered"
+        " in the cache. References between sections aren't checked."
+    ),
+)
+@click.option(
+    "--changed-since",
+    metavar="REF",
+    help=(
+        "Only format files changed since the merge base of REF and HEAD,"
+        " and only changed docstrings and code blocks in .py, Markdown and LaTeX files."
+    ),
+)
+@click.option(
+    "--stdin-filename",
+    type=click.Path(),
+    help="The name of the file read from stdin when SRC is -, used to pick the formatter.",
+)
+@click.option(
+    "--serve",
+    is_flag=True,
+    help="Read newline delimited JSON format requests from stdin and write the responses to stdout.",
+)
+@click.option(
+    "--include",
+    type=str,
+    default=DEFAULT_INCLUDES,
+    help=(
+        "A regular expression that matches files and directories that should be included on recursive searches."
+        " Use forward slashes for directories on all platforms (Windows, too)."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--exclude",
+    type=str,
+    default=DEFAULT_EXCLUDES,
+    help=(
+        "A regular expression that matches files and directories that should be excluded on recursive searches."
+        " Files and directories matched by a .gitignore are excluded as well."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--extend-exclude",
+    type=str,
+    help="Like --exclude, but adds additional files and directories on top of the excluded ones.",
+)
+@click.option(
+    "--stream-threshold",
+    type=click.IntRange(min=0),
+    default=DEFAULT_STREAM_THRESHOLD,
+    metavar="BYTES",
+    help=(
+        "Format files bigger than this a top-level section or code block at a time, to keep memory use down."
+        " References between sections of streamed reStructuredText files aren't checked."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--error-format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    help=(
+        "How to report code blocks that can't be formatted. json writes a list of {path, line, column, message}"
+        " objects to stdout once all files are done and everything else to stderr, or the list to stderr for stdin."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--stats",
+    "stats_file",
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+    help="Write JSON timings of every formatting stage, per file, and the slowest files and blocks to this file.",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write a cProfile dump of the run to this file, worker processes aren't profiled.",
+)
 @click.argument(
     "src",
     nargs=-1,
     type=click.Path(exists=True, file_okay=True, dir_okay=True, readable=True, allow_dash=True),
     is_eager=True,
 )
+@click.option(
+    "--config",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, allow_dash=False),
+    is_eager=True,
+    callback=black.read_pyproject_toml,
+    help="Read configuration from this file, by default the [tool.black] table of the project's pyproject.toml.",
+)
 @click.pass_context
 def main(
     ctx: click.Context,
@@ -204,22 +864,196 @@ def main(
     target_version: Set[black.TargetVersion],
     check: bool,
     diff: bool,
+    diff_only: bool,
+    preserve_mtime: bool,
     skip_string_normalization: bool,
+    workers: int,
+    async_io: bool,
+    no_daemon: bool,
+    no_cache: bool,
+    incremental: bool,
+    changed_since: Optional[str],
+    stdin_filename: Optional[str],
+    serve: bool,
+    include: str,
+    exclude: str,
+    extend_exclude: Optional[str],
+    stream_threshold: int,
+    error_format: str,
+    stats_file: Optional[str],
+    profile: Optional[str],
     src: Tuple[str, ...],
+    config: Optional[str],
 ) -> None:
 
+    diff = diff or diff_only
     report = black.Report(check=check, diff=diff)
-    root = black.find_project_root(src)
-    sources = recursive_file_finder(root)
-
     mode = black.Mode(
         target_versions=target_version, line_length=line_length, string_normalization=not skip_string_normalization,
     )
 
-    for filename in sources:
-        format_file(filename, mode, report=report)
-    print("Oh no! 💥 💔 💥" if report.return_code else "All done! ✨ 🍰 ✨")
-    print(str(report))
+    if serve:
+        from blacken_docs.server import serve as serve_requests
+
+        serve_requests(click.get_text_stream("stdin"), click.get_text_stream("stdout"), mode)
+        ctx.exit(0)
+    if src == ("-",):
+        format_stdin(
+            mode, report, path=pathlib.Path(stdin_filename) if stdin_filename else None, error_format=error_format
+        )
+        ctx.exit(report.return_code)
+
+    regexes = {}
+    for name, value in (("include", include), ("exclude", exclude), ("extend-exclude", extend_exclude)):
+        try:
+            regexes[name] = black.re_compile_maybe_verbose(value) if value else None
+        except re.error:
+            black.err(f"Invalid regular expression for {name} given: {value!r}")
+            ctx.exit(2)
+    if not src:
+        black.out("No Path provided. Nothing to do 😴")
+        ctx.exit(0)
+
+    root = black.find_project_root(src)
+    paths = [pathlib.Path(path) for path in src]
+    # with --async-io the sources are walked and filtered by a reading thread
+    walk_report = _ThreadReport(report) if async_io else report
+    sources: Iterable[pathlib.Path]
+    lines: Optional[Dict[pathlib.Path, Optional[LineRanges]]] = None
+    if changed_since is not None:
+        try:
+            lines = changed_lines(changed_since, root)
+        except (GitError, OSError) as exc:
+            black.err(f"error: cannot find files changed since {changed_since}: {exc}")
+            ctx.exit(2)
+        resolved = [path.resolve() for path in paths]
+        sources = [
+            path
+            for path in sorted(lines)
+            if any(path == parent or parent in path.parents for parent in resolved)
+            and is_included(path, root, regexes["include"], regexes["exclude"], regexes["extend-exclude"])
+        ]
+    else:
+        sources = iter_files(
+            paths, root, regexes["include"], regexes["exclude"], regexes["extend-exclude"], report=walk_report
+        )
+
+    profiler = None
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    run_stats = stats.RunStats() if stats_file or stats.has_hooks() else None
+    collect_stats = run_stats is not None
+
+    cache = None if no_cache or diff else Cache.read(mode)
+    if cache is not None:
+        sources = _filter_cached(sources, cache, walk_report)
+        formatter.block_cache.load(str(cache.blocks_path))
+    incremental = incremental and cache is not None
+
+    client = None
+    # a daemon can't time or profile this run, and the section indexes are kept by this process
+    if not (no_daemon or async_io or collect_stats or profiler or incremental):
+        from blacken_docs.client import find_daemon
+
+        client = find_daemon()
+
+    error_records: Optional[List[Dict[str, Any]]] = [] if error_format == "json" else None
+    results: Iterator[FileResult]
+    if client is not None:
+        from blacken_docs.client import format_files
+
+        results = format_files(
+            client,
+            sources,
+            mode,
+            check=check,
+            diff=diff,
+            lines=lines,
+            stream_threshold=stream_threshold,
+            preserve_mtime=preserve_mtime,
+        )
+    elif async_io:
+        from blacken_docs.pipeline import format_paths
+
+        results = format_paths(
+            sources,
+            mode,
+            check=check,
+            diff=diff,
+            workers=workers,
+            lines=lines,
+            collect_stats=collect_stats,
+            stream_threshold=stream_threshold,
+            preserve_mtime=preserve_mtime,
+            incremental=incremental,
+        )
+    elif workers > 1:
+        results = format_many(
+            sources,
+            mode,
+            check=check,
+            diff=diff,
+            workers=workers,
+            lines=lines,
+            collect_stats=collect_stats,
+            stream_threshold=stream_threshold,
+            preserve_mtime=preserve_mtime,
+            incremental=incremental,
+            in_order=True,  # so the output doesn't depend on the number of workers
+        )
+    else:
+        results = (
+            _format_file(
+                path,
+                mode,
+                check=check,
+                diff=diff,
+                lines=(lines or {}).get(path),
+                collect_stats=collect_stats,
+                stream_threshold=stream_threshold,
+                preserve_mtime=preserve_mtime,
+                incremental=incremental,
+            )
+            for path in sources
+        )
+    for result in results:
+        if isinstance(walk_report, _ThreadReport):
+            walk_report.flush()
+        if run_stats is not None and result.timings is not None:
+            run_stats.add_file(str(result.path), result.timings)
+        failed = _report_result(result, report, error_records)
+        # only remember files that are now formatted on disk, all of them rather than just the changed lines
+        formatted = not check or result.changed is black.Changed.NO
+        if cache is not None and not failed and formatted and (lines or {}).get(result.path) is None:
+            cache.mark_formatted(result.path)
+    if isinstance(walk_report, _ThreadReport):
+        walk_report.flush()
+    if client is not None:
+        client.close()
+    if cache is not None:
+        cache.write()
+        formatter.block_cache.dump(str(cache.blocks_path))
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+    if run_stats is not None and stats_file:
+        # worker processes have their own block caches, so these are only complete without --workers
+        summary = json.dumps(run_stats.to_json({"block_cache": formatter.block_cache.info()._asdict()}), indent=2)
+        if stats_file == "-":
+            print(summary)
+        else:
+            with open(stats_file, "w", encoding="UTF-8") as f:
+                f.write(summary + "\n")
+
+    if error_records is not None:
+        print(json.dumps(error_records, indent=2))
+    summary_file = sys.stderr if diff_only or error_records is not None else sys.stdout
+    print("Oh no! 💥 💔 💥" if report.return_code else "All done! ✨ 🍰 ✨", file=summary_file)
+    print(str(report), file=summary_file)
     ctx.exit(report.return_code)
 
 
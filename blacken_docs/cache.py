@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""Skip files that are already formatted, similar to black's ``cache.pickle``.
+
+Entries are keyed on the SHA-256 of a file's type and contents, the cache file itself is keyed on the effective
+``black.Mode`` and the black and blacken-docs versions so changing any of them starts from scratch. With
+``--incremental`` each reStructuredText file also gets a :class:`SectionIndex` of its formatted sections.
+"""
+
+import hashlib
+import heapq
+import os
+import pathlib
+import pickle
+import tempfile
+import time
+from typing import Dict, Optional, Union
+
+import black
+
+MAX_ENTRIES = 50_000
+
+
+def get_cache_dir() -> pathlib.Path:
+    env = os.environ.get("BLACKEN_DOCS_CACHE_DIR")
+    if env:
+        return pathlib.Path(env)
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return pathlib.Path(base, "blacken-docs")
+
+
+def get_cache_key(mode: black.Mode) -> str:
+    from blacken_docs import __version__
+
+    key = f"{__version__}|{black.__version__}|{mode.get_cache_key()}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def digest(contents: Union[str, bytes], suffix: Optional[str] = None) -> str:
+    """SHA-256 of ``contents``, and of the file type with ``suffix`` as the formatter depends on it."""
+    if isinstance(contents, str):
+        contents = contents.encode("UTF-8")
+    if suffix is not None:
+        contents = suffix.encode("UTF-8") + b"\0" + contents
+    return hashlib.sha256(contents).hexdigest()
+
+
+def digest_file(path: pathlib.Path, block_size: int = 2 ** 20, suffix: Optional[str] = None) -> str:
+    """:func:`digest` of a file's contents, read a block at a time so huge files aren't held in memory."""
+    sha256 = hashlib.sha256()
+    if suffix is not None:
+        sha256.update(suffix.encode("UTF-8") + b"\0")
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class Cache:
+    def __init__(self, path: pathlib.Path, entries: Dict[str, float], max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.blocks_path = path.with_name("blocks." + path.name[len("cache.") :])  # see formatter.BlockCache
+        self.entries = entries  # digest of the file type and contents -> last time it was seen
+        self.max_entries = max_entries
+
+    @classmethod
+    def read(
+        cls, mode: black.Mode, cache_dir: Optional[pathlib.Path] = None, max_entries: int = MAX_ENTRIES
+    ) -> "Cache":
+        """Read the cache if it exists and is well formed, otherwise start with an empty one."""
+        path = (cache_dir or get_cache_dir()) / f"cache.{get_cache_key(mode)}.pickle"
+        try:
+            with path.open("rb") as f:
+                entries = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            entries = {}
+        if not isinstance(entries, dict):
+            entries = {}
+        return cls(path, entries, max_entries)
+
+    def is_formatted(self, file: pathlib.Path) -> bool:
+        try:
+            return self._seen(digest_file(file, suffix=file.suffix))
+        except OSError:
+            return False
+
+    def is_formatted_contents(self, contents: str, path: pathlib.Path) -> bool:
+        """Whether ``contents`` is formatted as the type of file ``path`` is."""
+        return self._seen(digest(contents, suffix=path.suffix))
+
+    def _seen(self, key: str) -> bool:
+        if key in self.entries:
+            self.entries[key] = time.time()
+            return True
+        return False
+
+    def mark_formatted(self, file: pathlib.Path) -> None:
+        try:
+            self.entries[digest_file(file, suffix=file.suffix)] = time.time()
+        except OSError:
+            pass
+
+    def mark_formatted_contents(self, contents: str, path: pathlib.Path) -> None:
+        self.entries[digest(contents, suffix=path.suffix)] = time.time()
+
+    def write(self) -> None:
+        """Atomically write the cache back, dropping the least recently seen entries over ``max_entries``."""
+        if len(self.entries) > self.max_entries:
+            self.entries = dict(heapq.nlargest(self.max_entries, self.entries.items(), key=lambda item: item[1]))
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=str(self.path.parent), delete=False) as f:
+                pickle.dump(self.entries, f, protocol=4)
+            os.replace(f.name, self.path)
+        except OSError:
+            pass
+
+
+class SectionIndex:
+    """The formatted output of the top-level sections of one file, keyed on the digest of each section's source.
+
+    The blank lines around a section don't change how it's formatted, so they aren't part of its key.
+
+    Only the sections looked up or added since it was read are written back, so it never grows past the file.
+    """
+
+    def __init__(self, path: pathlib.Path, entries: Dict[str, str]):
+        self.path = path
+        self.entries = entries
+        self.seen: Dict[str, str] = {}
+
+    @classmethod
+    def read(cls, file: pathlib.Path, mode: black.Mode, cache_dir: Optional[pathlib.Path] = None) -> "SectionIndex":
+        name = f"{digest(str(file.resolve()))[:16]}.{get_cache_key(mode)}.pickle"
+        path = (cache_dir or get_cache_dir()) / "sections" / name
+        try:
+            with path.open("rb") as f:
+                entries = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            entries = {}
+        if not isinstance(entries, dict):
+            entries = {}
+        return cls(path, entries)
+
+    def get(self, source: str) -> Optional[str]:
+        key = digest(source.strip("\n"))
+        formatted = self.entries.get(key)
+        if formatted is not None:
+            self.seen[key] = formatted
+        return formatted
+
+    def add(self, source: str, formatted: str) -> None:
+        self.seen[digest(source.strip("\n"))] = formatted
+
+    def write(self) -> None:
+        if self.seen == self.entries:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=str(self.path.parent), delete=False) as f:
+                pickle.dump(self.seen, f, protocol=4)
+            os.replace(f.name, self.path)
+        except OSError:
+            pass
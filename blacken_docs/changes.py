@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""Find the files, and the lines inside them, that changed since a git ref.
+
+Everything is read from the local index and object store, nothing is fetched.
+"""
+
+import pathlib
+import re
+import subprocess
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LineRanges = List[Tuple[int, int]]  # inclusive, 1-based
+
+HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+ESCAPE_RE = re.compile(rb"\\([0-7]{3}|.)")
+C_ESCAPES = {b"a": b"\a", b"b": b"\b", b"f": b"\f", b"n": b"\n", b"r": b"\r", b"t": b"\t", b"v": b"\v"}
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(*args: str, cwd: pathlib.Path) -> str:
+    proc = subprocess.run(
+        ("git", *args), cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    if proc.returncode:
+        raise GitError(proc.stderr.strip() or f"git {args[0]} failed")
+    return proc.stdout
+
+
+def _unquote(name: str) -> str:
+    """A file name as git writes it in a diff header, C-quoted if it has special characters in it."""
+    if name.endswith("\t"):  # added after names with spaces in them
+        name = name[:-1]
+    if not (len(name) > 1 and name[0] == name[-1] == '"'):
+        return name
+
+    def unescape(match: "re.Match[bytes]") -> bytes:
+        escape = match.group(1)
+        return bytes([int(escape, 8)]) if len(escape) == 3 else C_ESCAPES.get(escape, escape)
+
+    return ESCAPE_RE.sub(unescape, name[1:-1].encode("UTF-8")).decode("UTF-8", "surrogateescape")
+
+
+def parse_diff(diff: str, root: pathlib.Path) -> Dict[pathlib.Path, LineRanges]:
+    """Map every file in a ``git diff -U0`` to the line ranges added or modified in its new version."""
+    changes: Dict[pathlib.Path, LineRanges] = {}
+    ranges: LineRanges = []
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            name = _unquote(line[4:])
+            if name == "/dev/null":  # deleted
+                ranges = []
+                continue
+            ranges = changes.setdefault(root / name[len("b/") :], [])
+        elif line.startswith("@@"):
+            match = HUNK_RE.match(line)
+            if match is None:
+                continue
+            start = int(match.group(1))
+            count = int(match.group(2) or 1)
+            if count:
+                ranges.append((start, start + count - 1))
+    return changes
+
+
+def changed_lines(
+    ref: str, root: pathlib.Path, suffixes: Sequence[str] = (".rst", ".py", ".md", ".markdown", ".tex")
+) -> Dict[pathlib.Path, Optional[LineRanges]]:
+    """Return the files with one of ``suffixes`` changed between the merge base of ``ref`` and the working tree.
+
+    Untracked files are changed in their entirety, which is signalled by ``None`` instead of a list of ranges.
+    Files which only had lines removed are left out.
+    """
+    toplevel = pathlib.Path(_git("rev-parse", "--show-toplevel", cwd=root).strip())
+    try:
+        base = _git("merge-base", ref, "HEAD", cwd=toplevel).strip()
+    except GitError:  # e.g. unrelated histories, diff against the ref itself
+        base = ref
+    pathspecs = [f"*{suffix}" for suffix in suffixes]
+    diff = _git(
+        "-c",
+        "core.quotePath=off",
+        "diff",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-renames",
+        "--src-prefix=a/",  # whatever diff.noprefix and diff.mnemonicPrefix say
+        "--dst-prefix=b/",
+        "--diff-filter=AM",
+        "-U0",
+        base,
+        "--",
+        *pathspecs,
+        cwd=toplevel,
+    )
+    changes: Dict[pathlib.Path, Optional[LineRanges]] = {
+        path: ranges for path, ranges in parse_diff(diff, toplevel).items() if ranges
+    }
+    for name in _git("ls-files", "--others", "--exclude-standard", "--", *pathspecs, cwd=toplevel).splitlines():
+        changes[toplevel / name] = None
+    return {path: ranges for path, ranges in changes.items() if path.is_file()}
+
+
+def intersects(start: int, end: int, ranges: Optional[LineRanges]) -> bool:
+    """Whether the lines ``start``-``end`` overlap with ``ranges``, ``None`` meaning the whole file."""
+    return ranges is None or any(start <= range_end and range_start <= end for range_start, range_end in ranges)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""Talk to a running ``blacken-docs-daemon``.
+
+``blacken-docs`` looks for a daemon at ``$BLACKEN_DOCS_DAEMON``, or the socket in the cache directory, and sends it
+the files to format instead of formatting them itself when it answers. Addresses are either the path of a Unix
+socket or ``host:port``.
+"""
+
+import itertools
+import json
+import os
+import pathlib
+import socket
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import black
+
+from blacken_docs import FileResult, __version__, _file_result, _format_file, _should_stream, _write_result
+from blacken_docs.cache import get_cache_dir
+from blacken_docs.changes import LineRanges
+from blacken_docs.formatter import CodeBlockError
+from blacken_docs.server import mode_to_json
+
+DEFAULT_WINDOW = 16  # requests sent ahead of their responses
+CONNECT_TIMEOUT = 1.0  # seconds
+
+Address = Union[str, Tuple[str, int]]
+
+
+class DaemonError(Exception):
+    pass
+
+
+def default_address() -> str:
+    return os.environ.get("BLACKEN_DOCS_DAEMON") or str(get_cache_dir() / "daemon.sock")
+
+
+def parse_address(address: str) -> Address:
+    """``host:port`` as a tuple, anything else is the path of a Unix socket."""
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit() and os.sep not in address:
+        return host.strip("[]"), int(port)
+    return address
+
+
+class Client:
+    def __init__(self, address: Address, timeout: Optional[float] = None):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET6 if ":" in address[0] else socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.settimeout(CONNECT_TIMEOUT)
+        try:
+            self.socket.connect(address)
+        except OSError:
+            self.socket.close()
+            raise
+        self.socket.settimeout(timeout)
+        self.reader = self.socket.makefile("rb")
+        self.next_id = 0
+
+    def close(self) -> None:
+        self.reader.close()
+        self.socket.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _send(self, request: Dict[str, Any]) -> int:
+        self.next_id += 1
+        self.socket.sendall(json.dumps({**request, "id": self.next_id}).encode("UTF-8") + b"\n")
+        return self.next_id
+
+    def _receive(self) -> Dict[str, Any]:
+        line = self.reader.readline()
+        if not line:
+            raise DaemonError("the daemon closed the connection")
+        response: Dict[str, Any] = json.loads(line)
+        return response
+
+    def request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self._send(request)
+        return self._receive()
+
+    def map(self, requests: Iterable[Dict[str, Any]], window: int = DEFAULT_WINDOW) -> Iterator[Dict[str, Any]]:
+        """Send ``requests`` keeping ``window`` of them in flight, yielding the responses as they come in.
+
+        The responses' ``id`` is the position of their request in ``requests``, counting from 1.
+        """
+        first_id = self.next_id
+        in_flight = 0
+        for request in requests:
+            if in_flight == window:
+                yield self._renumber(self._receive(), first_id)
+                in_flight -= 1
+            self._send(request)
+            in_flight += 1
+        for _ in range(in_flight):
+            yield self._renumber(self._receive(), first_id)
+
+    @staticmethod
+    def _renumber(response: Dict[str, Any], first_id: int) -> Dict[str, Any]:
+        if response.get("id") is not None:
+            response["id"] -= first_id
+        return response
+
+
+def find_daemon(address: Optional[str] = None) -> Optional[Client]:
+    """Connect to the daemon at ``address`` if one is running and healthy, ``None`` otherwise.
+
+    A daemon running another version of blacken-docs or black, e.g. one started before an upgrade, doesn't count.
+    """
+    parsed = parse_address(address or default_address())
+    if isinstance(parsed, str) and (not hasattr(socket, "AF_UNIX") or not os.path.exists(parsed)):
+        return None
+    try:
+        client = Client(parsed)
+    except OSError:
+        return None
+    try:
+        response = client.request({"op": "ping"})
+        versions = response.get("version"), response.get("black")
+        if response.get("status") == "ok" and versions == (__version__, black.__version__):
+            return client
+    except (OSError, ValueError, DaemonError):
+        pass
+    client.close()
+    return None
+
+
+def format_files(
+    client: Client,
+    sources: Iterable[pathlib.Path],
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[Dict[pathlib.Path, Optional[LineRanges]]] = None,
+    stream_threshold: Optional[int] = None,
+    preserve_mtime: bool = False,
+) -> Iterator[FileResult]:
+    """:func:`blacken_docs.format_many` with the formatting done by the daemon, files are read and written here.
+
+    Files big enough to be streamed are formatted here, they would have to be held in memory by both sides otherwise.
+    """
+    pending: Dict[int, Tuple[pathlib.Path, str]] = {}  # files in flight by request id
+    request_ids = itertools.count(1)
+    done_here: List[FileResult] = []
+
+    def requests() -> Iterator[Dict[str, Any]]:
+        for path in sources:
+            try:
+                if _should_stream(path, stream_threshold):
+                    done_here.append(
+                        _format_file(
+                            path,
+                            mode,
+                            check=check,
+                            diff=diff,
+                            lines=(lines or {}).get(path),
+                            stream_threshold=stream_threshold,
+                            preserve_mtime=preserve_mtime,
+                        )
+                    )
+                    continue
+                with open(path, encoding="UTF-8") as f:
+                    original = f.read()
+            except (OSError, UnicodeDecodeError) as exc:
+                done_here.append(FileResult(path, black.Changed.NO, [], [str(exc)]))
+                continue
+            pending[next(request_ids)] = (path, original)
+            yield {
+                "op": "format",  # the content is needed to tell whether it changed, and for --diff
+                "path": str(path),
+                "content": original,
+                "mode": mode_to_json(mode),
+                "lines": (lines or {}).get(path),
+            }
+
+    for response in client.map(requests()):
+        yield from done_here
+        done_here.clear()
+        if response["id"] not in pending:
+            raise DaemonError(response.get("error", "unexpected response"))
+        path, original = pending.pop(response["id"])
+        if "error" in response:
+            yield FileResult(path, black.Changed.NO, [], [response["error"]])
+            continue
+        errors = [
+            CodeBlockError(error["line"], error["src"], black.InvalidInput(error["message"]), error.get("column", 1))
+            for error in response["errors"]
+        ]
+        result, new_contents = _file_result(path, original, response["content"], errors, check=check, diff=diff)
+        if new_contents is not None:
+            result = _write_result(result, new_contents, preserve_mtime=preserve_mtime)
+        yield result
+    yield from done_here
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""Keep black and docutils warm in a long-lived process, like blackd but for documentation.
+
+While ``blacken-docs-daemon`` runs ``blacken-docs`` sends it the files to format instead of paying for the imports
+and the set up on every run, see :mod:`blacken_docs.client`. It speaks the protocol of :mod:`blacken_docs.server`
+on a Unix socket or ``host:port``, any number of connections can have requests in flight at the same time, and
+``{"op": "ping"}`` is answered with its health::
+
+    {"id": 1, "status": "ok", "pid": 1234, "version": "1.7.0", "uptime": 12.5, "requests": 42, "connections": 1}
+
+It exits once it had no connections for ``--idle-timeout`` seconds.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set
+
+import black
+import click
+
+from blacken_docs import __version__, _process_pool, format_contents
+from blacken_docs.client import DaemonError, default_address, find_daemon, parse_address
+from blacken_docs.server import handle_request
+
+DEFAULT_IDLE_TIMEOUT = 600  # seconds
+MAX_REQUEST_SIZE = 2 ** 30  # bytes in a line of JSON
+MAX_IN_FLIGHT = 64  # requests per connection
+
+WARM_UP = "Title\n=====\n\nReturns None\n\n.. code-block:: python\n\n    f(1,2)\n"
+
+
+def warm_up() -> None:
+    """Do the imports and set up that happen on first use, in the process that runs it."""
+    format_contents(WARM_UP, mode=black.Mode())
+
+
+class Daemon:
+    def __init__(self, mode: black.Mode, executor: Executor):
+        self.mode = mode
+        self.executor = executor
+        self.started = time.monotonic()
+        self.last_active = self.started
+        self.connections = 0
+        self.requests = 0
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "version": __version__,
+            "black": black.__version__,
+            "uptime": time.monotonic() - self.started,
+            "requests": self.requests,
+            "connections": self.connections,
+        }
+
+    async def handle_line(self, line: bytes) -> Dict[str, Any]:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+        except ValueError as exc:
+            return {"id": None, "error": f"invalid request: {exc}"}
+        if request.get("op") == "ping":
+            return {"id": request.get("id"), **self.health()}
+        self.requests += 1
+        response: Dict[str, Any] = await asyncio.get_event_loop().run_in_executor(
+            self.executor, handle_request, request, self.mode
+        )
+        return response
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        write_lock = asyncio.Lock()  # concurrent drain() calls aren't supported
+        tasks: Set["asyncio.Future[None]"] = set()
+
+        async def respond(line: bytes) -> None:
+            try:
+                response = await self.handle_line(line)
+                async with write_lock:
+                    writer.write(json.dumps(response).encode("UTF-8") + b"\n")
+                    await writer.drain()
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await in_flight.acquire()
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError):  # ValueError for a line over MAX_REQUEST_SIZE
+            pass
+        finally:
+            writer.close()
+            self.connections -= 1
+            self.last_active = time.monotonic()
+
+    async def wait_idle(self, idle_timeout: float) -> None:
+        """Return once there were no connections for ``idle_timeout`` seconds, never if it's 0."""
+        while not idle_timeout or self.connections or time.monotonic() - self.last_active < idle_timeout:
+            await asyncio.sleep(min(idle_timeout, 1.0) if idle_timeout else 60)
+
+
+def _remove_stale_socket(path: str) -> None:
+    client = find_daemon(path)
+    if client is not None:
+        client.close()
+        raise DaemonError(f"a daemon is already running at {path}")
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def run(
+    address: str,
+    *,
+    mode: Optional[black.Mode] = None,
+    workers: int = 1,
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    ready: Optional[Callable[[], None]] = None,
+) -> None:
+    """Serve requests on ``address`` until idle for ``idle_timeout`` seconds, calling ``ready`` once listening.
+
+    Requests are formatted by a pool of ``workers`` processes, or by a thread for one worker, with ``mode`` for the
+    options they don't set.
+    """
+    parsed = parse_address(address)
+    executor = _process_pool(workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_event_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(workers)))
+    daemon = Daemon(mode or black.Mode(), executor)
+    try:
+        if isinstance(parsed, str):
+            os.makedirs(os.path.dirname(os.path.abspath(parsed)), exist_ok=True)
+            _remove_stale_socket(parsed)
+            server = await asyncio.start_unix_server(daemon.handle_connection, parsed, limit=MAX_REQUEST_SIZE)
+            os.chmod(parsed, 0o600)
+        else:
+            server = await asyncio.start_server(daemon.handle_connection, *parsed, limit=MAX_REQUEST_SIZE)
+        try:
+            if ready is not None:
+                ready()
+            await daemon.wait_idle(idle_timeout)
+        finally:
+            server.close()
+            await server.wait_closed()
+            if isinstance(parsed, str) and os.path.exists(parsed):
+                os.remove(parsed)
+    finally:
+        executor.shutdown()
+
+
+@click.command(context_settings=dict(help_option_names=["-h", "--help"]))
+@click.option(
+    "--bind",
+    metavar="ADDRESS",
+    help="Unix socket path or host:port to listen on. [default: $BLACKEN_DOCS_DAEMON or daemon.sock in the cache]",
+)
+@click.option(
+    "-W",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes formatting requests in parallel.",
+    show_default=True,
+)
+@click.option(
+    "--idle-timeout",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_IDLE_TIMEOUT,
+    metavar="SECONDS",
+    help="Exit after this long without a connection, 0 to never exit.",
+    show_default=True,
+)
+def main(bind: Optional[str], workers: int, idle_timeout: float) -> None:
+    """Format documentation for blacken-docs clients, keeping black and docutils warm between runs."""
+    address = bind or default_address()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(
+        run(address, workers=workers, idle_timeout=idle_timeout, ready=lambda: black.out(f"Listening on {address}"))
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, task.cancel)  # so the socket is cleaned up
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        loop.run_until_complete(task)
+    except DaemonError as exc:
+        black.err(str(exc))
+        raise SystemExit(1)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
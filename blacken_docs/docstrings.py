@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""Locate module, class and function docstrings in Python source without importing it.
+
+The source is parsed once with ``ast`` to know which string literals are docstrings and tokenized once to get
+their exact offsets, every docstring can then be replaced in a single pass.
+"""
+
+import ast
+import io
+import re
+import tokenize
+from typing import Iterable, List, NamedTuple, Tuple
+
+STRING_PREFIX_RE = re.compile(r"^([a-zA-Z]*)('''|\"\"\"|'|\")", re.S)
+DOCSTRING_OWNERS = (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+
+
+class Docstring(NamedTuple):
+    start: int  # offset of the string token in the source
+    end: int
+    lineno: int  # first and last line of the token, 1-based
+    end_lineno: int
+    indent: int  # column of the statement
+    prefix: str  # string prefix and opening quotes, e.g. r'''
+    body: str  # everything between the quotes, as written in the source
+
+    @property
+    def quote(self) -> str:
+        return self.prefix.lstrip("rRuU")
+
+
+def _docstring_positions(tree: ast.AST) -> Iterable[Tuple[int, int]]:
+    for node in ast.walk(tree):
+        if isinstance(node, DOCSTRING_OWNERS) and ast.get_docstring(node, clean=False) is not None:
+            value = node.body[0].value
+            yield value.lineno, value.col_offset
+
+
+def find_docstrings(source: str) -> List[Docstring]:
+    """Return every docstring in ``source`` in order, raises ``SyntaxError`` if it can't be parsed."""
+    positions = set(_docstring_positions(ast.parse(source)))
+    lines = io.StringIO(source).readlines()  # split the same way tokenize does
+    line_offsets = [0]
+    for line in lines:
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    # ast column offsets are in UTF-8 bytes, tokenize's are in characters
+    starts = set()
+    end_lines = set()
+    for lineno, col_offset in positions:
+        if col_offset == -1:  # multi-line strings on python < 3.8 only have the line they end on
+            end_lines.add(lineno)
+        else:
+            line = lines[lineno - 1].encode("UTF-8")
+            starts.add((lineno, len(line[:col_offset].decode("UTF-8"))))
+
+    docstrings = []
+    tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    for index, token in enumerate(tokens):
+        if token.type != tokenize.STRING or (token.start not in starts and token.end[0] not in end_lines):
+            continue
+        if tokens[index + 1].type == tokenize.STRING:  # implicitly concatenated, leave it alone
+            continue
+        match = STRING_PREFIX_RE.match(token.string)
+        if match is None or not set(match.group(1)) <= set("rRuU"):
+            continue
+        prefix = match.group(0)
+        (lineno, col), (end_lineno, end_col) = token.start, token.end
+        line = lines[lineno - 1]
+        docstrings.append(
+            Docstring(
+                start=line_offsets[lineno - 1] + col,
+                end=line_offsets[end_lineno - 1] + end_col,
+                lineno=lineno,
+                end_lineno=end_lineno,
+                indent=len(line) - len(line.lstrip()),
+                prefix=prefix,
+                body=token.string[len(prefix) : -len(match.group(2))],
+            )
+        )
+    return docstrings
+
+
+def splice(source: str, replacements: Iterable[Tuple[Docstring, str]]) -> str:
+    """Replace the body of each docstring with its new text in one pass over ``source``."""
+    parts = []
+    position = 0
+    for docstring, body in sorted(replacements, key=lambda replacement: replacement[0].start):
+        parts.append(source[position : docstring.start])
+        parts.append(f"{docstring.prefix}{body}{docstring.quote}")
+        position = docstring.end
+    parts.append(source[position:])
+    return "".join(parts)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""Split doctest sessions into the source of each example and everything else.
+
+Examples are found with :mod:`doctest`'s rules: a ``>>>`` line and the ``...`` lines straight after it are the
+source, the rest, including the expected output, is left as it is.
+"""
+
+import re
+from typing import List, NamedTuple, Union
+
+PS1_RE = re.compile(r"(?P<indent> *)>>>(?: |$)")
+
+
+class Example(NamedTuple):
+    indent: str
+    source: str  # the code without its prompts
+    trailing: int  # empty ``...`` lines after the code, which end compound statements
+    newline: str  # the line ending of the example's last line
+    original: str
+
+
+def is_doctest(code: str) -> bool:
+    return code.lstrip().startswith(">>>")
+
+
+def _split_newline(line: str) -> List[str]:
+    content = line.rstrip("\r\n")
+    return [content, line[len(content) :]]
+
+
+def parse(text: str) -> List[Union[str, Example]]:
+    """Return ``text`` as a list of examples and the lines around them."""
+    lines = text.splitlines(True)
+    parts: List[Union[str, Example]] = []
+    index = 0
+    while index < len(lines):
+        content, _ = _split_newline(lines[index])
+        match = PS1_RE.match(content)
+        if match is None:
+            parts.append(lines[index])
+            index += 1
+            continue
+
+        indent = match["indent"]
+        source = [content[len(indent) + 4 :]]
+        end = index + 1
+        valid = True
+        while end < len(lines):
+            content, _ = _split_newline(lines[end])
+            if not content.lstrip(" ").startswith("..."):
+                break
+            if content != f"{indent}..." and not content.startswith(f"{indent}... "):
+                valid = False  # doctest refuses these, so leave the example alone
+                break
+            source.append(content[len(indent) + 4 :])
+            end += 1
+
+        original = "".join(lines[index:end])
+        trailing = 0
+        while len(source) > 1 and not source[-1].strip():
+            source.pop()
+            trailing += 1
+        code = "\n".join(source)
+        if valid and code.strip():
+            parts.append(Example(indent, f"{code}\n", trailing, _split_newline(lines[end - 1])[1], original))
+        else:
+            parts.append(original)
+        index = end
+    return parts
+
+
+def render(example: Example, source: str) -> str:
+    """Return ``example`` with its code replaced by ``source``."""
+    first, *rest = source.rstrip("\n").split("\n")
+    lines = [f"{example.indent}>>> {first}"]
+    lines.extend(f"{example.indent}... {line}" if line else f"{example.indent}..." for line in rest)
+    lines.extend([f"{example.indent}..."] * example.trailing)
+    return "\n".join(lines) + example.newline
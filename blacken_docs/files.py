@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""Find the documentation files to format.
+
+Directories are walked iteratively with ``os.scandir`` and excluded directories are pruned before they are
+descended into, paths are yielded as soon as they are found so formatting can start straight away.
+"""
+
+import os
+import pathlib
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+import black
+
+if TYPE_CHECKING:
+    from pathspec import PathSpec
+
+DEFAULT_INCLUDES = r"\.(py|rst|md|markdown|tex)$"
+DEFAULT_EXCLUDES = black.DEFAULT_EXCLUDES
+
+
+def read_gitignore(directory: str) -> Optional["PathSpec"]:
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="UTF-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    from pathspec import PathSpec  # only needed once there is a .gitignore to match
+
+    return PathSpec.from_lines("gitwildmatch", lines) if lines else None
+
+
+def is_excluded(normalized: str, exclude: Pattern[str], extend_exclude: Optional[Pattern[str]]) -> bool:
+    return bool(exclude.search(normalized) or (extend_exclude is not None and extend_exclude.search(normalized)))
+
+
+def _normalize(path: str, root: str) -> str:
+    """Return ``path`` relative to ``root`` with a leading ``/`` and no trailing one, ``""`` for the root itself."""
+    relative = os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+    return "" if relative == "." else "/" + relative
+
+
+def iter_files(
+    paths: Iterable[pathlib.Path],
+    root: pathlib.Path,
+    include: Pattern[str],
+    exclude: Pattern[str],
+    extend_exclude: Optional[Pattern[str]] = None,
+    *,
+    gitignore: bool = True,
+    report: Optional[black.Report] = None,
+) -> Iterator[pathlib.Path]:
+    """Yield the files in ``paths`` to format, in a deterministic order.
+
+    Files given explicitly are always yielded. Files found in directories need to match ``include`` and neither
+    ``exclude``, ``extend_exclude`` nor a ``.gitignore`` between ``root`` and them. Patterns are matched against
+    the path relative to ``root`` with a leading ``/``, directories also get a trailing ``/``, just like black.
+    """
+    root_str = os.path.abspath(root)
+    for path in paths:
+        if path.is_file():
+            yield path
+            continue
+        if not path.is_dir():
+            black.err(f"invalid path: {path}")
+            continue
+
+        start = str(path)
+        prefix = _normalize(start, root_str)
+        # .gitignore specs paired with the normalized path of the directory they apply to
+        specs: List[Tuple[str, "PathSpec"]] = []
+        if gitignore:  # every .gitignore from the root down to where the walk starts
+            parents = [os.path.abspath(start)]
+            while parents[-1] != root_str and os.path.dirname(parents[-1]) != parents[-1]:
+                parents.append(os.path.dirname(parents[-1]))
+            for directory in reversed(parents[1:]):
+                spec = read_gitignore(directory)
+                if spec is not None:
+                    specs.append((_normalize(directory, root_str), spec))
+
+        stack: List[Tuple[str, str, List[Tuple[str, "PathSpec"]]]] = [(start, prefix, specs)]
+        while stack:
+            directory, prefix, specs = stack.pop()
+            if gitignore:
+                spec = read_gitignore(directory)
+                if spec is not None:
+                    specs = [*specs, (prefix, spec)]
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as exc:
+                black.err(f"cannot read {directory}: {exc}")
+                continue
+
+            subdirectories = []
+            for entry in entries:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                normalized = f"{prefix}/{entry.name}/" if is_dir else f"{prefix}/{entry.name}"
+                if any(spec.match_file(normalized[len(spec_prefix) + 1 :]) for spec_prefix, spec in specs):
+                    if report is not None:
+                        report.path_ignored(pathlib.Path(entry.path), "matches the .gitignore file content")
+                    continue
+                if is_excluded(normalized, exclude, extend_exclude):
+                    if report is not None:
+                        report.path_ignored(pathlib.Path(entry.path), "matches the --exclude regular expression")
+                    continue
+                if is_dir:
+                    subdirectories.append((entry.path, normalized[:-1]))
+                elif include.search(normalized) and entry.is_file():
+                    yield pathlib.Path(entry.path)
+            # reversed so the first subdirectory is walked first
+            stack.extend((subdirectory, normalized, specs) for subdirectory, normalized in reversed(subdirectories))
+
+
+def is_included(
+    path: pathlib.Path,
+    root: pathlib.Path,
+    include: Pattern[str],
+    exclude: Pattern[str],
+    extend_exclude: Optional[Pattern[str]] = None,
+) -> bool:
+    """Whether :func:`iter_files` would yield ``path`` when walking ``root``, ignoring .gitignore files."""
+    normalized = _normalize(str(path), os.path.abspath(root))
+    return bool(include.search(normalized)) and not is_excluded(normalized, exclude, extend_exclude)
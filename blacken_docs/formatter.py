@@ -1,25 +1,54 @@
 # -*- coding: utf-8 -*-
 
+import ast
 import builtins
-import inspect
+import dataclasses
+import functools
+import itertools
+import os
+import pickle
 import re
+import tempfile
 import textwrap
+import threading
+import warnings
 import string as _string
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Match,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import black
-from docutils import nodes, utils
-from docutils.core import Publisher
+from blib2to3.pgen2.tokenize import TokenError
+from docutils import nodes
+
+from blacken_docs import doctests, stats
+
+if TYPE_CHECKING:
+    from docutils.parsers.rst import Parser
 
 PY_LANGS = ("python", "py", "sage", "python3", "py3", "numpy")
 BLOCK_TYPES = ("code", "code-block", "sourcecode", "ipython")
+# builtins' namespace is already sorted by name, which is all inspect.getmembers would add
 EXCEPTIONS = tuple(
-    name for name, _ in inspect.getmembers(builtins, lambda e: inspect.isclass(e) and BaseException in e.__mro__)
+    name for name, obj in sorted(vars(builtins).items()) if isinstance(obj, type) and issubclass(obj, BaseException)
 )
 TYPES = tuple(
     name
-    for name, _ in inspect.getmembers(
-        builtins, lambda o: inspect.isclass(o) and o.__name__ not in EXCEPTIONS and not o.__name__[0].isupper()
-    )
+    for name, obj in sorted(vars(builtins).items())
+    if isinstance(obj, type) and obj.__name__ not in EXCEPTIONS and not obj.__name__[0].isupper()
 )
 INLINE_WRAPPED_TYPES = ("\d+", "None", "NoneType", "True", "False") + EXCEPTIONS + TYPES
 PUNCTUATION = tuple(_string.punctuation)
@@ -63,6 +92,42 @@ POSSIBLE_TITLES = (
 )
 
 
+class CodeBlockError(NamedTuple):
+    line_number: int
+    src: str
+    exc: Exception
+    column: int = 1  # 1-based, like line_number
+
+
+CANNOT_PARSE_RE = re.compile(r"^Cannot parse: (\d+):(\d+):")
+
+
+def error_position(exc: Exception) -> Optional[Tuple[int, int]]:
+    """The 1-based line and 0-based column black reported ``exc`` at, if it did."""
+    match = CANNOT_PARSE_RE.match(str(exc))
+    if match is None:
+        return None
+    return int(match[1]), int(match[2])
+
+
+def block_error(
+    exc: Exception, *, src: str, lines: Sequence[str], dedented: Sequence[str], line_number: int
+) -> CodeBlockError:
+    """A :class:`CodeBlockError` for ``exc`` raised by black on the code block ``src`` starting on ``line_number``.
+
+    ``lines`` are the lines of the block as they are in the file and ``dedented`` the same lines as black got them,
+    the difference between the two is added to the column black reported.
+    """
+    position = error_position(exc)
+    if position is None or not lines:
+        return CodeBlockError(line_number, src, exc)
+    line, column = position
+    if line > len(lines):  # the block ended in the middle of a statement, point at the end of it
+        return CodeBlockError(line_number + len(lines) - 1, src, exc, len(lines[-1].rstrip()) + 1)
+    indent = len(lines[line - 1]) - len(dedented[line - 1])
+    return CodeBlockError(line_number + line - 1, src, exc, indent + column + 1)
+
+
 # need to get the rst prolog and use those
 
 
@@ -75,22 +140,59 @@ def is_not_fully_wrapped(string: str):
     return False
 
 
-FIND_NOT_INLINE_TYPES = re.compile(rf"^({'|'.join(INLINE_WRAPPED_TYPES)})\W?$")
-FIND_INLINE_TYPES = re.compile(rf"^``({'|'.join(INLINE_WRAPPED_TYPES)})``\W?$")
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Return a regex matching any of ``words``, nested by common prefix so a mismatch fails on its first character."""
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1 and "" not in node:
+            return alternatives[0]
+        return f"(?:{'|'.join(alternatives)}){'?' if '' in node else ''}"
+
+    return build(trie)
+
+
+@functools.lru_cache(maxsize=None)
+def inline_word_re() -> Pattern[str]:
+    """Return the regex matching words :func:`fix_inline` changes, compiled on first use as it is fairly large.
+
+    Words are runs of anything but spaces. A word is either a name to wrap, optionally followed by a punctuation mark
+    and a newline, or something only partially wrapped in backticks, like `None` or ```int``.
+    """
+    return re.compile(
+        rf"""
+        (?<![^ ])
+        (?:
+            (?P<name>\d+|{_trie_pattern(("None", "NoneType", "True", "False") + EXCEPTIONS + TYPES)})
+            (?P<tail>[^\w ]?\n?)
+        |
+            (?!``[^ ]*``(?:\ |\Z))
+            (?P<quoted>`[^ ]{{3,}}`)
+        )
+        (?=\ |\Z)
+        """,
+        re.X,
+    )
+
+
+def _fix_inline_word(match: Match[str]) -> str:
+    if match["quoted"] is not None:
+        return f"``{match['quoted'].strip('`')}``"
+    # the punctuation is dropped, as is the newline unless there was punctuation before it
+    return f"``{match['name']}``\n" if len(match["tail"]) == 2 else f"``{match['name']}``"
 
 
 def fix_inline(string: str) -> str:
-    formatted = []
-    for line in string.splitlines(True):
-        for word in line.split(" "):
-            if FIND_NOT_INLINE_TYPES.match(word):  # general match
-                if not FIND_INLINE_TYPES.match(word):  # strict match
-                    word = FIND_NOT_INLINE_TYPES.sub(r"``\1``", word.strip("`"))
-            if is_not_fully_wrapped(word):  # simple fix
-                word = f"``{word.strip('`')}``"
-            formatted.append(word)
-
-    text = "\n".join(" ".join(formatted).splitlines())
+    text = inline_word_re().sub(_fix_inline_word, " ".join(string.splitlines(True)))
+    text = "\n".join(text.splitlines())
     return textwrap.dedent(f" {text}")  # don't why ask
 
 
@@ -123,29 +225,298 @@ def wrap_text(string: str, mode: black.Mode):  # take up as little vertical spac
     return STARTING_LINE_WS.sub(r"\1\2", string)
 
 
+class BlockCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def _format_block(code: str, mode: black.Mode) -> Union[str, black.InvalidInput]:
+    try:
+        with stats.timer("black", block=code):
+            return black.format_str(code, mode=mode)
+    except black.InvalidInput as exc:
+        return exc
+    except TokenError as exc:  # unclosed brackets, reported like black reports everything else
+        message, (line, column) = exc.args
+        return black.InvalidInput(f"Cannot parse: {line}:{column}: {message}")
+
+
+class BlockCache:
+    """LRU cache of ``black.format_str`` results keyed on the dedented code and the mode.
+
+    ``black.InvalidInput`` is cached as well, prose that falls through to black is just as repetitive as code.
+    It can be shared between threads, black runs outside of the lock.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Union[str, black.InvalidInput]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def format(self, code: str, *, mode: black.Mode) -> str:
+        result = self.format_many([code], mode=mode)[0]
+        if isinstance(result, black.InvalidInput):
+            raise black.InvalidInput(*result.args)
+        return result
+
+    def format_many(
+        self, codes: Sequence[str], *, mode: black.Mode, executor: Optional[Executor] = None
+    ) -> List[Union[str, black.InvalidInput]]:
+        """Format ``codes``, returning ``black.InvalidInput`` for code black can't parse instead of raising it.
+
+        Code that isn't cached is formatted in one batch, on ``executor`` if one is given.
+        """
+        mode_key = mode.get_cache_key()
+        results: Dict[str, Union[str, black.InvalidInput]] = {}
+        missing = []
+        with self._lock:
+            for code in dict.fromkeys(codes):
+                key = (code, mode_key)
+                try:
+                    results[code] = self._entries[key]
+                except KeyError:
+                    missing.append(code)
+                else:
+                    self._entries.move_to_end(key)
+            self.misses += len(missing)
+            self.hits += len(codes) - len(missing)
+
+        if missing:
+            formatted: Iterable[Union[str, black.InvalidInput]]
+            if executor is None:
+                formatted = map(_format_block, missing, itertools.repeat(mode))
+            else:
+                formatted = executor.map(_format_block, missing, itertools.repeat(mode))
+            for code, result in zip(missing, formatted):
+                results[code] = result
+            with self._lock:
+                for code in missing:
+                    self._entries[(code, mode_key)] = results[code]
+                self._evict()
+        return [results[code] for code in codes]
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def info(self) -> BlockCacheInfo:
+        with self._lock:
+            return BlockCacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.hits = self.misses = 0
+            self._entries.clear()
+
+    def load(self, path: str) -> None:
+        """Merge previously dumped entries into the cache, ignoring a missing or corrupt file."""
+        try:
+            with open(path, "rb") as f:
+                entries = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return
+        if isinstance(entries, dict):
+            with self._lock:
+                for key, value in entries.items():
+                    self._entries.setdefault(key, value)
+                self._evict()
+
+    def dump(self, path: str) -> None:
+        """Atomically persist the successfully formatted entries to ``path``."""
+        with self._lock:
+            entries = {key: value for key, value in self._entries.items() if isinstance(value, str)}
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", delete=False) as f:
+                pickle.dump(entries, f, protocol=4)
+            os.replace(f.name, path)
+        except OSError:
+            pass
+
+
+block_cache = BlockCache()
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Yield the lines of ``text`` with their newlines, without splitting all of it up front like ``splitlines``."""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start) + 1 or len(text)
+        yield text[start:end]
+        start = end
+
+
+def format_code_block(
+    code: str, *, mode: black.Mode, indent: str, line_number: int, errors: List[CodeBlockError]
+) -> str:
+    """Return ``code`` dedented, formatted and indented by ``indent``, or as is if black fails on it."""
+    dedented = textwrap.dedent(code)
+    if doctests.is_doctest(dedented):
+        return textwrap.indent(format_doctest(dedented, mode=mode), indent)
+    try:
+        return textwrap.indent(block_cache.format(dedented, mode=mode), indent)
+    except Exception as exc:  # black raises more than InvalidInput for some broken code
+        lines, dedented_lines = code.splitlines(), dedented.splitlines()
+        errors.append(block_error(exc, src=code, lines=lines, dedented=dedented_lines, line_number=line_number))
+        return code
+
+
 def blacken_code_blocks(code: str, *, mode: black.Mode, indent=4) -> str:
-    return textwrap.indent(black.format_str(textwrap.dedent(code), mode=mode), prefix=" " * indent)
-    # TODO add support for ">>> " and "... "
+    code = textwrap.dedent(code)
+    formatted = format_doctest(code, mode=mode) if doctests.is_doctest(code) else block_cache.format(code, mode=mode)
+    return textwrap.indent(formatted, prefix=" " * indent)
 
 
-def generate_doc(content: str) -> nodes.document:  # restructuredtext_lint.lint
-    """Return a nodes.document ready for reading from."""
-    pub = Publisher(None, None, None, settings=None)
-    pub.set_components("standalone", "restructuredtext", "pseudoxml")
-    settings = pub.get_settings(halt_level=5)
-    pub.set_io()
-    reader = pub.reader
-    document = utils.new_document(None, settings)
+def blacken_code_blocks_many(
+    codes: Sequence[str], *, mode: black.Mode, indent=4, executor: Optional[Executor] = None
+) -> List[Union[str, black.InvalidInput]]:
+    """:func:`blacken_code_blocks` for every one of ``codes`` in one batch, returning errors instead of raising."""
+    codes = [textwrap.dedent(code) for code in codes]
+    results: List[Union[str, black.InvalidInput]] = [
+        format_doctest(code, mode=mode, executor=executor) if doctests.is_doctest(code) else ""
+        for code in codes
+    ]
+    code_indexes = [index for index, code in enumerate(codes) if not doctests.is_doctest(code)]
+    formatted = block_cache.format_many([codes[index] for index in code_indexes], mode=mode, executor=executor)
+    for index, result in zip(code_indexes, formatted):
+        results[index] = result
+    return [textwrap.indent(result, " " * indent) if isinstance(result, str) else result for result in results]
+
+
+def format_doctest(code: str, *, mode: black.Mode, executor: Optional[Executor] = None) -> str:
+    """Format the code of every example in the doctest session ``code``, their expected output is left alone.
+
+    Examples are formatted one statement at a time so repeated ones like ``>>> import x`` hit the block cache,
+    the ones that don't compile, or wouldn't be a single statement any more, are left as they are.
+    """
+    parts = doctests.parse(code)
+    examples = [part for part in parts if isinstance(part, doctests.Example) and is_python(part.source, single=True)]
+    prompt_mode = dataclasses.replace(mode, line_length=mode.line_length - len(">>> "))
+    sources = [example.source for example in examples]
+    results = dict(zip(examples, block_cache.format_many(sources, mode=prompt_mode, executor=executor)))
+    ret = []
+    for part in parts:
+        if isinstance(part, doctests.Example):
+            result = results.get(part)
+            if isinstance(result, str) and ("\n" not in result.rstrip("\n") or is_python(result, single=True)):
+                part = doctests.render(part, result)
+            else:
+                part = part.original
+        ret.append(part)
+    return "".join(ret)
+
+
+def is_python(code: str, *, single: bool = False) -> bool:
+    """Whether ``code`` compiles, which is much cheaper than finding out from black that prose isn't code.
+
+    With ``single`` it also has to be one statement, as doctest compiles examples in interactive mode.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # e.g. invalid escape sequences, they aren't ours to report
+            compile(
+                textwrap.dedent(code),
+                "<code block>",
+                "single" if single else "exec",
+                ast.PyCF_ONLY_AST,
+                dont_inherit=True,
+            )
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+_settings = None
+_components = ()
+_settings_lock = threading.Lock()
+_parsers = threading.local()
+
+
+def get_settings():
+    """Return the docutils settings, built once per process as running the option parser is expensive."""
+    global _settings, _components
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                from docutils.core import Publisher
+
+                pub = Publisher(None, None, None, settings=None)
+                pub.set_components("standalone", "restructuredtext", "pseudoxml")
+                settings = pub.get_settings(halt_level=5)
+                pub.set_io()
+                _components = (pub.source, pub.reader, pub.reader.parser, pub.writer, pub.destination)
+                _settings = settings
+    return _settings
+
+
+def get_parser() -> "Parser":
+    """Return this thread's rst parser, parsers keep their state machine around so can't be shared."""
+    try:
+        return _parsers.parser
+    except AttributeError:
+        from docutils.parsers.rst import Parser
+
+        _parsers.parser = parser = Parser()
+        return parser
+
+
+def parse_doc(content: str) -> Tuple[nodes.document, List[nodes.system_message]]:
+    """Parse ``content`` once, returning the document and the system messages reported while parsing.
+
+    Messages raised by transforms are collected separately by :func:`apply_transforms` as transforms
+    restructure the tree.
+    """
+    messages: List[nodes.system_message] = []
+    from docutils.utils import new_document
+
+    document = new_document(None, get_settings())
     document.reporter.stream = None
-    reader.parser.parse(content, document)
-    return document
+    document.reporter.attach_observer(messages.append)
+    get_parser().parse(content, document)
+    document.reporter.detach_observer(messages.append)
+    return document, messages
+
+
+def apply_transforms(document: nodes.document) -> List[nodes.system_message]:
+    """Run the standalone reader's transforms over ``document`` like ``restructuredtext_lint.lint`` does.
+
+    This mutates the tree, so only call it once you are done reading from the document.
+    """
+    messages: List[nodes.system_message] = []
+    document.reporter.attach_observer(messages.append)
+    get_settings()
+    transformer = document.transformer
+    transformer.populate_from_components(_components)
+    # Transformer.apply_transforms attaches its own observer which inserts the messages into the document
+    while transformer.transforms:
+        if not transformer.sorted:
+            transformer.transforms.sort()
+            transformer.transforms.reverse()
+            transformer.sorted = 1
+        priority, transform_class, pending, kwargs = transformer.transforms.pop()
+        transform = transform_class(document, startnode=pending)
+        transform.apply(**kwargs)
+        transformer.applied.append((priority, transform_class, pending, kwargs))
+    document.reporter.detach_observer(messages.append)
+    return messages
+
+
+def generate_doc(content: str) -> nodes.document:
+    """Return a nodes.document ready for reading from."""
+    return parse_doc(content)[0]
 
 
 def wrap_and_fix(text: str, *, mode: black.Mode, indent: int = None) -> str:
     if indent is not None:
         mode.line_length -= indent
-    text = fix_inline(text)
-    text = wrap_text(text, mode=mode)
+    with stats.timer("fix_inline"):
+        text = fix_inline(text)
+    with stats.timer("wrap_text"):
+        text = wrap_text(text, mode=mode)
 
     if indent is not None:
         mode.line_length += indent
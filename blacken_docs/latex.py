@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""Format the python code blocks in LaTeX documents.
+
+Python ``minted`` environments and pythontex's code environments are found in a single pass over the lines, no
+tree is built and only the code of one block is held in memory at a time.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import black
+
+from blacken_docs.changes import LineRanges, intersects
+from blacken_docs.formatter import PY_LANGS, CodeBlockError, format_code_block, iter_lines
+
+LATEX_SUFFIXES = (".tex",)
+PYTHONTEX_ENVIRONMENTS = ("pyblock", "pycode", "pyverbatim")
+BEGIN_RE = re.compile(
+    r"(?P<indent> *)\\begin\{"
+    r"(?:(?P<minted>minted)\}(?:\[[^\]]*\])?\{(?P<lang>[^}]*)|(?P<pythontex>" + "|".join(PYTHONTEX_ENVIRONMENTS) + r"))"
+    r"\}\s*$"
+)
+
+
+def iter_latex(
+    lines: Iterable[str], *, mode: black.FileMode, errors: List[CodeBlockError], ranges: Optional[LineRanges] = None,
+) -> Iterator[str]:
+    """Yield ``lines`` with the python code blocks formatted, appending to ``errors`` for blocks black can't parse.
+
+    Only blocks overlapping ``ranges`` are formatted if they are given. A block without an ``\\end`` is left alone.
+    """
+    lines = iter(lines)
+    lineno = 0
+    for line in lines:
+        lineno += 1
+        yield line
+        match = BEGIN_RE.match(line)
+        if match is None or (match["minted"] and match["lang"].strip().lower() not in PY_LANGS):
+            continue
+
+        indent = match["indent"]
+        end = f"\\end{{{match['minted'] or match['pythontex']}}}"
+        start = lineno + 1
+        code = []
+        closing = None
+        for line in lines:
+            lineno += 1
+            if line.startswith(indent) and line.strip() == end:
+                closing = line
+                break
+            code.append(line)
+
+        src = "".join(code)
+        if closing is not None and src.strip() and intersects(start, lineno - 1, ranges):
+            src = format_code_block(src, mode=mode, indent=indent, line_number=start, errors=errors)
+        yield src
+        if closing is not None:
+            yield closing
+
+
+def format_latex(
+    src: str, *, mode: black.FileMode, lines: Optional[LineRanges] = None
+) -> Tuple[str, List[CodeBlockError]]:
+    errors: List[CodeBlockError] = []
+    return "".join(iter_latex(iter_lines(src), mode=mode, errors=errors, ranges=lines)), errors
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Format the python code blocks in Markdown documents.
+
+Fenced code blocks are found in a single pass over the lines, nothing else is parsed. Everything but the code of
+python blocks is copied through as is.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import black
+
+from blacken_docs.changes import LineRanges, intersects
+from blacken_docs.formatter import PY_LANGS, CodeBlockError, format_code_block, iter_lines
+
+MARKDOWN_SUFFIXES = (".md", ".markdown")
+OPENING_FENCE_RE = re.compile(r"(?P<indent> *)(?P<fence>`{3,}|~{3,})\s*(?P<info>[^\s`]*)")
+
+
+def _closes(line: str, indent: str, fence: str) -> bool:
+    stripped = line.strip()
+    return line.startswith(indent) and len(stripped) >= len(fence) and stripped == fence[0] * len(stripped)
+
+
+def iter_markdown(
+    lines: Iterable[str], *, mode: black.FileMode, errors: List[CodeBlockError], ranges: Optional[LineRanges] = None,
+) -> Iterator[str]:
+    """Yield ``lines`` with the python code blocks formatted, appending to ``errors`` for blocks black can't parse.
+
+    Only blocks overlapping ``ranges`` are formatted if they are given. A block without a closing fence is left alone.
+    """
+    lines = iter(lines)
+    lineno = 0
+    for line in lines:
+        lineno += 1
+        yield line
+        match = OPENING_FENCE_RE.match(line)
+        if match is None or (match["fence"][0] == "`" and "`" in line[match.end() :]):
+            continue
+
+        indent, fence = match["indent"], match["fence"]
+        start = lineno + 1
+        code = []
+        closing = None
+        for line in lines:
+            lineno += 1
+            if _closes(line, indent, fence):
+                closing = line
+                break
+            code.append(line)
+
+        src = "".join(code)
+        if (
+            closing is not None
+            and match["info"].lower() in PY_LANGS
+            and src.strip()
+            and intersects(start, lineno - 1, ranges)
+        ):
+            src = format_code_block(src, mode=mode, indent=indent, line_number=start, errors=errors)
+        yield src
+        if closing is not None:
+            yield closing
+
+
+def format_markdown(
+    src: str, *, mode: black.FileMode, lines: Optional[LineRanges] = None
+) -> Tuple[str, List[CodeBlockError]]:
+    errors: List[CodeBlockError] = []
+    return "".join(iter_markdown(iter_lines(src), mode=mode, errors=errors, ranges=lines)), errors
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Write formatted files back and diff them.
+
+Files are replaced atomically, the new contents go to a temporary file in the same directory that is renamed over
+the original, so a crash or a full disk never leaves a file half written.
+"""
+
+import collections
+import contextlib
+import difflib
+import itertools
+import os
+import pathlib
+import stat
+import tempfile
+from typing import Deque, Iterable, Iterator, List, Tuple
+
+DIFF_CONTEXT = 3
+
+
+@contextlib.contextmanager
+def temporary_sibling(path: pathlib.Path) -> Iterator[Tuple[int, str]]:
+    """Create a temporary file next to ``path``, it's removed on exit unless :func:`replace` moved it over ``path``."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        yield fd, tmp
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def replace(tmp: str, path: pathlib.Path, *, preserve_mtime: bool = False) -> None:
+    """Atomically move ``tmp`` over ``path``, keeping its permissions and with ``preserve_mtime`` its times."""
+    st = path.stat()
+    os.chmod(tmp, stat.S_IMODE(st.st_mode))
+    if preserve_mtime:
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, path)
+
+
+def write_atomic(path: pathlib.Path, contents: str, *, preserve_mtime: bool = False) -> None:
+    with temporary_sibling(path) as (fd, tmp):
+        with open(fd, "w", encoding="UTF-8") as f:
+            f.write(contents)
+        replace(tmp, path, preserve_mtime=preserve_mtime)
+
+
+def _format_range(start: int, length: int) -> str:
+    """``start,length`` of a hunk header from a 0-based ``start``, as ``diff -u`` writes it."""
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def _diff_lines(marker: str, lines: List[str]) -> Iterator[str]:
+    for line in lines:
+        if line.endswith("\n"):
+            yield marker + line
+        else:
+            yield f"{marker}{line}\n\\ No newline at end of file\n"
+
+
+def unified_diff(
+    a: Iterable[str], b: Iterable[str], a_name: str, b_name: str, context: int = DIFF_CONTEXT
+) -> Iterator[str]:
+    """Yield the lines of a unified diff between the lines ``a`` and ``b``, like :func:`difflib.unified_diff`.
+
+    The common leading lines are skipped while reading, only ``context`` of them are kept, and the common trailing
+    lines are cut off before diffing, so only the part of a file that changed is compared line by line.
+    """
+    a_iter, b_iter = iter(a), iter(b)
+    prefix: Deque[str] = collections.deque(maxlen=context)
+    skipped = 0
+    a_rest: List[str] = []
+    b_rest: List[str] = []
+    for a_line, b_line in itertools.zip_longest(a_iter, b_iter):
+        if a_line != b_line:
+            a_rest = [] if a_line is None else [a_line]
+            b_rest = [] if b_line is None else [b_line]
+            break
+        if len(prefix) == context:
+            skipped += 1
+        prefix.append(a_line)
+    else:
+        return
+    a_rest.extend(a_iter)
+    b_rest.extend(b_iter)
+
+    suffix = 0
+    while suffix < min(len(a_rest), len(b_rest)) and a_rest[-1 - suffix] == b_rest[-1 - suffix]:
+        suffix += 1
+    suffix = max(suffix - context, 0)
+    a_lines = [*prefix, *a_rest[: len(a_rest) - suffix]]
+    b_lines = [*prefix, *b_rest[: len(b_rest) - suffix]]
+
+    yield f"--- {a_name}\n"
+    yield f"+++ {b_name}\n"
+    for group in difflib.SequenceMatcher(None, a_lines, b_lines).get_grouped_opcodes(context):
+        a_start, a_end, b_start, b_end = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        a_range = _format_range(skipped + a_start, a_end - a_start)
+        b_range = _format_range(skipped + b_start, b_end - b_start)
+        yield f"@@ -{a_range} +{b_range} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                yield from _diff_lines(" ", a_lines[i1:i2])
+                continue
+            if tag in {"replace", "delete"}:
+                yield from _diff_lines("-", a_lines[i1:i2])
+            if tag in {"replace", "insert"}:
+                yield from _diff_lines("+", b_lines[j1:j2])
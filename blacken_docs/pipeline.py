@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""Overlap reading and writing files with formatting them.
+
+Files are read by threads ahead of the formatting workers and written back by threads behind them, so slow disks
+and network filesystems keep the workers busy instead of stalling them::
+
+    async for result in format_paths_async(paths, mode, workers=4):
+        print(result.path, result.changed)
+
+The queues between the stages are bounded, at most ``max_pending`` files are waiting in memory on either side of
+the workers however many files there are.
+"""
+
+import asyncio
+import pathlib
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, Optional, Tuple
+
+import black
+
+from blacken_docs import (
+    FileResult,
+    _format_file,
+    _format_original,
+    _process_pool,
+    _should_stream,
+    _write_result,
+    stats,
+)
+from blacken_docs.changes import LineRanges
+
+DEFAULT_MAX_PENDING = 16  # files waiting to be formatted, and separately to be written
+IO_THREADS = 4
+
+_DONE = object()
+
+
+def _read(path: pathlib.Path, stream_threshold: Optional[int]) -> Optional[str]:
+    """The contents of ``path``, or ``None`` if it's big enough to be streamed by the worker instead."""
+    if _should_stream(path, stream_threshold):
+        return None
+    with open(path, encoding="UTF-8") as f:
+        return f.read()
+
+
+def _format_read(
+    path: pathlib.Path,
+    original: Optional[str],
+    mode: black.FileMode,
+    *,
+    check: bool,
+    diff: bool,
+    lines: Optional[LineRanges],
+    collect_stats: bool,
+    stream_threshold: Optional[int],
+    preserve_mtime: bool,
+    incremental: bool,
+) -> Tuple[FileResult, Optional[str]]:
+    """Runs in a worker, returns the result and the contents for the writer if the file should be rewritten."""
+    if original is None:
+        result = _format_file(
+            path,
+            mode,
+            check=check,
+            diff=diff,
+            lines=lines,
+            collect_stats=collect_stats,
+            stream_threshold=stream_threshold,
+            preserve_mtime=preserve_mtime,
+            incremental=incremental,
+        )
+        return result, None
+    format_original = partial(
+        _format_original, path, original, mode, check=check, diff=diff, lines=lines, incremental=incremental
+    )
+    if not collect_stats:
+        return format_original()
+    with stats.collect() as file_stats, stats.timer("file"):
+        result, new_contents = format_original()
+    return result._replace(timings=file_stats), new_contents
+
+
+async def format_paths_async(
+    paths: Iterable[pathlib.Path],
+    mode: black.FileMode,
+    *,
+    check: bool = False,
+    diff: bool = False,
+    lines: Optional[Dict[pathlib.Path, Optional[LineRanges]]] = None,
+    workers: int = 1,
+    executor: Optional[Executor] = None,
+    max_pending: int = DEFAULT_MAX_PENDING,
+    collect_stats: bool = False,
+    stream_threshold: Optional[int] = None,
+    preserve_mtime: bool = False,
+    incremental: bool = False,
+) -> AsyncIterator[FileResult]:
+    """Format ``paths``, yielding the results in the order the files are done.
+
+    ``paths`` is iterated in a thread, so it can be a lazy directory walk. The formatting runs in ``executor``, by
+    default a process pool of ``workers`` processes, or a single thread for one worker. ``workers`` files are
+    formatted at a time either way. With ``collect_stats`` the timings only cover the formatting, not the reads
+    and writes.
+    """
+    loop = asyncio.get_event_loop()
+    io_executor = ThreadPoolExecutor(max_workers=IO_THREADS)
+    own_executor = executor is None
+    if executor is None:
+        executor = _process_pool(workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    format_read = partial(
+        _format_read,
+        mode=mode,
+        check=check,
+        diff=diff,
+        collect_stats=collect_stats,
+        stream_threshold=stream_threshold,
+        preserve_mtime=preserve_mtime,
+        incremental=incremental,
+    )
+    to_format: "asyncio.Queue[Any]" = asyncio.Queue(max_pending)
+    to_write: "asyncio.Queue[Any]" = asyncio.Queue(max_pending)
+
+    async def read() -> None:
+        sources = iter(paths)
+        try:
+            while True:
+                path = await loop.run_in_executor(io_executor, next, sources, None)
+                if path is None:
+                    break
+                try:
+                    contents = await loop.run_in_executor(io_executor, _read, path, stream_threshold)
+                except Exception as exc:  # can't be read or decoded, skip straight to the writer to report it
+                    await to_write.put((FileResult(path, black.Changed.NO, [], [str(exc)]), None))
+                else:
+                    await to_format.put((path, contents))
+        finally:
+            for _ in range(workers):
+                await to_format.put(_DONE)
+
+    async def format_queued() -> None:
+        while True:
+            item = await to_format.get()
+            if item is _DONE:
+                break
+            path, contents = item
+            try:
+                result = await loop.run_in_executor(
+                    executor, partial(format_read, path, contents, lines=(lines or {}).get(path))
+                )
+            except Exception as exc:
+                result = (FileResult(path, black.Changed.NO, [], [str(exc)]), None)
+            await to_write.put(result)
+
+    async def format_all() -> None:
+        try:
+            await asyncio.gather(*(format_queued() for _ in range(workers)))
+        finally:
+            await to_write.put(_DONE)
+
+    tasks = [asyncio.ensure_future(read()), asyncio.ensure_future(format_all())]
+    try:
+        while True:
+            item = await to_write.get()
+            if item is _DONE:
+                break
+            result, new_contents = item
+            if new_contents is not None:
+                result = await loop.run_in_executor(
+                    io_executor, partial(_write_result, result, new_contents, preserve_mtime=preserve_mtime)
+                )
+            yield result
+        await asyncio.gather(*tasks)  # re-raise anything that went wrong reading
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        io_executor.shutdown()
+        if own_executor:
+            executor.shutdown()
+
+
+def format_paths(paths: Iterable[pathlib.Path], mode: black.FileMode, **kwargs: Any) -> Iterator[FileResult]:
+    """:func:`format_paths_async` for synchronous code, running an event loop while waiting for each result."""
+    loop = asyncio.new_event_loop()
+    results = format_paths_async(paths, mode, **kwargs)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
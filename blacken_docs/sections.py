@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""Split reStructuredText at its top-level section titles while it is being read.
+
+Huge generated files can then be formatted a section at a time, so only the largest section has to be in memory,
+and ``--incremental`` only formats the sections that changed since the last run.
+Top-level sections are the ones using the first title style in the document, as docutils decides.
+"""
+
+import string
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+ADORNMENT_CHARACTERS = frozenset(string.punctuation)
+
+
+def _adornment(line: str) -> Optional[str]:
+    """Return the character ``line`` is made of if it could be a title's under or overline."""
+    stripped = line.rstrip()
+    if len(stripped) >= 2 and stripped[0] in ADORNMENT_CHARACTERS and stripped == stripped[0] * len(stripped):
+        return stripped[0]
+    return None
+
+
+def _is_title(line: str) -> bool:
+    return bool(line.strip()) and not line[0].isspace() and _adornment(line) is None
+
+
+def iter_sections(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Yield ``(line number, text)`` for each top-level section of ``lines``, and for any text before the first one.
+
+    Text that only looks like a title, such as an unindented literal block, can cause an extra split, which is
+    harmless as sections are independent.
+    """
+    chunk: List[str] = []
+    start = 1
+    top_level: Optional[Tuple[str, bool]] = None  # adornment character and whether it has an overline
+    for line in lines:
+        chunk.append(line)
+        character = _adornment(line)
+        if character is None or len(chunk) < 2 or not _is_title(chunk[-2]):
+            continue
+        title_start = len(chunk) - 2
+        overline = title_start > 0 and _adornment(chunk[title_start - 1]) == character
+        if overline:
+            title_start -= 1
+        if len(line.rstrip()) < len(chunk[-2].rstrip()) or (title_start > 0 and chunk[title_start - 1].strip()):
+            continue  # underlines have to be long enough and titles start a new paragraph
+
+        style = (character, overline)
+        if top_level is None:
+            top_level = style
+        if style == top_level and title_start > 0:
+            yield start, "".join(chunk[:title_start])
+            start += title_start
+            chunk = chunk[title_start:]
+    if chunk:
+        yield start, "".join(chunk)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Newline delimited JSON protocol spoken by ``blacken-docs --serve``.
+
+Every request is a JSON object on a line of its own::
+
+    {"id": 1, "path": "docs/index.rst", "content": "...", "mode": {"line_length": 79}}
+
+``path`` is only a hint used to pick the formatter, nothing is read from or written to disk. ``mode`` overrides the
+options given on the command line. ``lines``, a list of ``[first, last]`` line ranges, limits formatting to the code
+blocks overlapping them like ``--changed-since`` does. Exactly one line is written back per request::
+
+    {"id": 1, "content": "...", "changed": true, "errors": [{"line": 3, "column": 5, "message": "...", "src": "..."}]}
+
+or ``{"id": 1, "error": "..."}`` if the request itself couldn't be handled. Requests with ``"op": "check"`` get the
+same response without the ``content``.
+"""
+
+import dataclasses
+import json
+import pathlib
+from typing import Any, Dict, Optional, TextIO
+
+import black
+
+from blacken_docs.changes import LineRanges
+
+
+def make_mode(base: black.Mode, overrides: Dict[str, Any]) -> black.Mode:
+    changes: Dict[str, Any] = {}
+    for key, value in overrides.items():
+        if key == "line_length":
+            changes["line_length"] = int(value)
+        elif key == "target_versions":
+            changes["target_versions"] = {black.TargetVersion[version.upper()] for version in value}
+        elif key == "skip_string_normalization":
+            changes["string_normalization"] = not value
+        elif key == "string_normalization":
+            changes["string_normalization"] = bool(value)
+        else:
+            raise ValueError(f"unknown mode option {key!r}")
+    return dataclasses.replace(base, **changes)
+
+
+def mode_to_json(mode: black.Mode) -> Dict[str, Any]:
+    """The ``mode`` of a request for ``mode``, the inverse of :func:`make_mode`."""
+    return {
+        "line_length": mode.line_length,
+        "target_versions": sorted(version.name.lower() for version in mode.target_versions),
+        "string_normalization": mode.string_normalization,
+    }
+
+
+def _make_lines(value: Any) -> Optional[LineRanges]:
+    if value is None:
+        return None
+    return [(int(start), int(end)) for start, end in value]
+
+
+def handle_request(request: Dict[str, Any], mode: black.Mode) -> Dict[str, Any]:
+    from blacken_docs import format_contents
+
+    response: Dict[str, Any] = {"id": request.get("id")}
+    try:
+        op = request.get("op", "format")
+        if op not in {"format", "check"}:
+            raise ValueError(f"unknown op {op!r}")
+        content = request["content"]
+        if not isinstance(content, str):
+            raise TypeError("content must be a string")
+        path = request.get("path")
+        mode = make_mode(mode, request.get("mode") or {})
+        formatted, errors = format_contents(
+            content, mode=mode, path=pathlib.Path(path) if path else None, lines=_make_lines(request.get("lines"))
+        )
+    except Exception as exc:
+        response["error"] = f"{type(exc).__name__}: {exc}"
+        return response
+
+    if op == "format":
+        response["content"] = formatted
+    response["changed"] = formatted != content
+    response["errors"] = [
+        {"line": error.line_number, "column": error.column, "message": str(error.exc) or error.src, "src": error.src}
+        for error in errors
+    ]
+    return response
+
+
+def serve(stdin: TextIO, stdout: TextIO, mode: black.Mode) -> None:
+    """Answer requests read from ``stdin`` until it is closed."""
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+        except ValueError as exc:
+            response: Dict[str, Any] = {"id": None, "error": f"invalid request: {exc}"}
+        else:
+            response = handle_request(request, mode)
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
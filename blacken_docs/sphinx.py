@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+"""Check the code blocks of a Sphinx project while it builds, from the doctrees Sphinx has already parsed.
+
+Add it to the extensions in ``conf.py``::
+
+    extensions = ["sphinx.ext.autodoc", "blacken_docs.sphinx"]
+    blacken_docs_line_length = 88  # the default
+    blacken_docs_write = False  # True to fix the files once the build is done
+    blacken_docs_write_roots = None  # the directories it may write in, the project root by default
+
+Every Python code block that black would change is reported as a warning, so ``sphinx-build -W`` fails on them.
+Docstrings are covered too, autodoc parses them into the same doctrees. Nothing is parsed or imported a second time,
+the only extra work is running black over the code blocks. With ``blacken_docs_write`` the blocks are replaced in
+their source files when the build finishes, the rest of the files is left as it is. Files are only written in the
+source and conf directories and ``blacken_docs_write_roots``, relative to the conf directory. It defaults to the
+project root black would find for the conf directory, the one with ``.git``, ``.hg`` or ``pyproject.toml``, so the
+docstrings of a package next to the documentation are fixed too.
+"""
+
+import inspect
+import os
+import pathlib
+import re
+import sys
+import textwrap
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+import black
+from docutils import nodes
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+from sphinx.util import logging
+
+from blacken_docs import __version__, formatter
+from blacken_docs.output import write_atomic
+
+logger = logging.getLogger(__name__)
+
+DOCSTRING_OF_RE = re.compile(r"(?:^|:)docstring of (?P<name>\S+)$")
+
+
+class Block(NamedTuple):
+    source: str  # the file the block is in
+    original: str
+    formatted: str
+
+
+def _mode(app: Sphinx) -> black.FileMode:
+    return black.FileMode(line_length=app.config.blacken_docs_line_length)
+
+
+def _is_python_block(node: nodes.Element) -> bool:
+    if len(node.children) != 1 or not isinstance(node[0], nodes.Text) or node.get("source"):
+        return False  # parsed-literal has markup in it and literalinclude's code lives in another file
+    if isinstance(node, nodes.doctest_block):
+        return True
+    language = node.get("language")
+    if language in formatter.PY_LANGS:
+        return True
+    return language in (None, "default") and formatter.is_python(node.astext())
+
+
+def _module_file(name: str) -> Optional[str]:
+    """The file of the longest imported module ``name`` starts with."""
+    parts = name.split(".")
+    for end in range(len(parts), 0, -1):
+        path = getattr(sys.modules.get(".".join(parts[:end])), "__file__", None)
+        if path is not None:
+            return path if path.endswith(".py") else None
+    return None
+
+
+def _source_file(env: BuildEnvironment, node: nodes.Node) -> Optional[str]:
+    source = node.source or str(env.doc2path(env.docname))
+    match = DOCSTRING_OF_RE.search(source)
+    if match is None:
+        return source
+    # not the path in front of it, autodoc caches module analyzers by name for the whole process
+    name = match["name"]
+    return env.blacken_docs_modules.get(env.docname, {}).get(name) or _module_file(name)
+
+
+def doctree_read(app: Sphinx, doctree: nodes.document) -> None:
+    env = app.env
+    findall = getattr(doctree, "findall", doctree.traverse)  # traverse is deprecated since docutils 0.18
+    found = [node for node in findall(nodes.literal_block) if _is_python_block(node)]
+    found += [node for node in findall(nodes.doctest_block) if _is_python_block(node)]
+    results = formatter.blacken_code_blocks_many([node.astext() for node in found], mode=_mode(app), indent=0)
+    blocks = env.blacken_docs_blocks.setdefault(env.docname, [])
+    for node, result in zip(found, results):
+        if isinstance(result, black.InvalidInput):
+            if node.get("language") in formatter.PY_LANGS:  # the others are only guessed to be Python
+                logger.warning(f"black can't parse code block: {result}", location=node, type="blacken-docs")
+            continue
+        original, formatted = node.astext(), result.rstrip("\n")
+        if formatted == original:
+            continue
+        if app.config.blacken_docs_warn:
+            logger.warning("code block would be reformatted by black", location=node, type="blacken-docs")
+        source = _source_file(env, node)
+        if source is not None:
+            blocks.append(Block(source, original, formatted))
+
+
+def autodoc_process_docstring(app: Sphinx, what: str, name: str, obj: Any, options: Any, lines: List[str]) -> None:
+    """Remember the file ``name`` is defined in, to find the code blocks of its docstring in."""
+    try:
+        path = inspect.getsourcefile(obj)
+    except TypeError:  # builtins and the like
+        return
+    if path is None:
+        return
+    modules = app.env.blacken_docs_modules.setdefault(app.env.docname, {})
+    modules[name] = os.path.abspath(path)
+    qualname = getattr(obj, "__qualname__", None)
+    if isinstance(qualname, str) and isinstance(getattr(obj, "__module__", None), str):
+        modules[f"{obj.__module__}.{qualname}"] = modules[name]  # how autodoc names the docstring's source
+
+
+def builder_inited(app: Sphinx) -> None:
+    if not hasattr(app.env, "blacken_docs_blocks"):  # a pickled environment already has them
+        app.env.blacken_docs_blocks = {}
+        app.env.blacken_docs_modules = {}
+    if "sphinx.ext.autodoc" in app.extensions:  # its events only exist once it's set up
+        app.connect("autodoc-process-docstring", autodoc_process_docstring)
+
+
+def env_purge_doc(app: Sphinx, env: BuildEnvironment, docname: str) -> None:
+    env.blacken_docs_blocks.pop(docname, None)
+    env.blacken_docs_modules.pop(docname, None)
+
+
+def env_merge_info(app: Sphinx, env: BuildEnvironment, docnames: Set[str], other: BuildEnvironment) -> None:
+    """Collect what the ``-j`` workers found while reading ``docnames``."""
+    for docname in docnames:
+        if docname in other.blacken_docs_blocks:
+            env.blacken_docs_blocks[docname] = other.blacken_docs_blocks[docname]
+        if docname in other.blacken_docs_modules:
+            env.blacken_docs_modules[docname] = other.blacken_docs_modules[docname]
+
+
+def replace_block(src: str, original: str, formatted: str) -> Optional[str]:
+    """``src`` with the first occurrence of the code block ``original`` replaced, at the same indentation.
+
+    ``None`` if it isn't there as is, e.g. a docstring that escapes characters in it.
+    """
+    first_line = original.split("\n", 1)[0]
+    for match in re.finditer(rf"^([ \t]*){re.escape(first_line)}$", src, flags=re.MULTILINE):
+        indented = textwrap.indent(original, match.group(1))
+        if src.startswith(indented, match.start()):
+            end = match.start() + len(indented)
+            return src[: match.start()] + textwrap.indent(formatted, match.group(1)) + src[end:]
+    return None
+
+
+def _write_roots(app: Sphinx) -> Set[pathlib.Path]:
+    roots = {pathlib.Path(app.srcdir).resolve(), pathlib.Path(app.confdir).resolve()}
+    if app.config.blacken_docs_write_roots is not None:
+        return roots | {pathlib.Path(app.confdir, root).resolve() for root in app.config.blacken_docs_write_roots}
+    project_root = black.find_project_root((str(app.confdir),))
+    if project_root != pathlib.Path(project_root.anchor):  # black falls back to the root of the file system
+        roots.add(project_root)
+    return roots
+
+
+def build_finished(app: Sphinx, exception: Optional[Exception]) -> None:
+    if exception is not None or not app.config.blacken_docs_write:
+        return
+    by_source: Dict[str, List[Block]] = defaultdict(list)
+    for blocks in app.env.blacken_docs_blocks.values():
+        for block in blocks:
+            by_source[block.source].append(block)
+    roots = _write_roots(app)
+    for source, blocks in sorted(by_source.items()):
+        path = pathlib.Path(source).resolve()
+        if not any(root == path.parent or root in path.parents for root in roots):
+            logger.warning(f"not rewriting {source}, it's outside of blacken_docs_write_roots", type="blacken-docs")
+            continue
+        try:
+            with open(source, encoding="UTF-8") as f:
+                src = f.read()
+        except (OSError, UnicodeDecodeError) as exc:
+            logger.warning(f"can't rewrite {source}: {exc}", type="blacken-docs")
+            continue
+        new_src = src
+        for block in blocks:
+            if source.endswith(".py") and ('"""' in block.formatted or "'''" in block.formatted):
+                continue  # would end the docstring
+            new_src = replace_block(new_src, block.original, block.formatted) or new_src
+        if new_src != src:
+            write_atomic(path, new_src)
+            logger.info(f"blacken-docs: reformatted {source}")
+
+
+def setup(app: Sphinx) -> Dict[str, Any]:
+    app.add_config_value("blacken_docs_line_length", black.DEFAULT_LINE_LENGTH, "env")
+    app.add_config_value("blacken_docs_warn", True, "env")
+    app.add_config_value("blacken_docs_write", False, "")
+    app.add_config_value("blacken_docs_write_roots", None, "")
+    app.connect("builder-inited", builder_inited)
+    app.connect("env-purge-doc", env_purge_doc)
+    app.connect("env-merge-info", env_merge_info)
+    app.connect("doctree-read", doctree_read)
+    app.connect("build-finished", build_finished)
+    return {"version": __version__, "env_version": 1, "parallel_read_safe": True, "parallel_write_safe": True}
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""Counters and timers for each stage of formatting.
+
+Nothing is recorded unless a :class:`Stats` is being collected into::
+
+    with stats.collect() as collected:
+        format_str(src, mode=mode)
+    collected.timings["parse"]
+
+``blacken-docs --stats FILE`` collects one per file, in the worker processes too, and writes a JSON summary.
+Functions registered with :func:`add_hook` are called with every file's path and stats as they come in, which is
+the place to feed the numbers into other metrics pipelines.
+"""
+
+import contextlib
+import heapq
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import contextvars
+except ImportError:  # Python 3.6
+    contextvars = None  # type: ignore
+
+SLOWEST = 10
+
+Hook = Callable[[str, "Stats"], None]
+_hooks: List[Hook] = []
+
+
+class _ThreadVar(threading.local):
+    """The part of ``contextvars.ContextVar`` used here, per thread only."""
+
+    value: Optional["Stats"] = None
+
+    def get(self) -> Optional["Stats"]:
+        return self.value
+
+    def set(self, value: Optional["Stats"]) -> Optional["Stats"]:
+        token, self.value = self.value, value
+        return token
+
+    def reset(self, token: Optional["Stats"]) -> None:
+        self.value = token
+
+
+# per thread and asyncio task, the daemon and the pipeline format several files at a time in one process
+_active: Any = contextvars.ContextVar("blacken_docs_stats", default=None) if contextvars else _ThreadVar()
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.timings: DefaultDict[str, float] = defaultdict(float)
+        self.counts: DefaultDict[str, int] = defaultdict(int)
+        self.blocks: List[Tuple[float, str]] = []  # min-heap of the slowest (seconds, first line of the block)
+
+    def add(self, stage: str, seconds: float, block: Optional[str] = None) -> None:
+        self.timings[stage] += seconds
+        self.counts[stage] += 1
+        if block is not None:
+            item = (seconds, block.strip().partition("\n")[0][:80])
+            if len(self.blocks) < SLOWEST:
+                heapq.heappush(self.blocks, item)
+            else:
+                heapq.heappushpop(self.blocks, item)
+
+    @property
+    def total(self) -> float:
+        return self.timings.get("file", 0.0)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "stages": {
+                stage: {"seconds": seconds, "count": self.counts[stage]} for stage, seconds in self.timings.items()
+            },
+            "slowest_blocks": [
+                {"seconds": seconds, "block": block} for seconds, block in sorted(self.blocks, reverse=True)
+            ],
+        }
+
+
+class RunStats:
+    """Every file's :class:`Stats` from a run."""
+
+    def __init__(self) -> None:
+        self.files: Dict[str, Stats] = {}
+
+    def add_file(self, path: str, stats: Stats) -> None:
+        self.files[path] = stats
+        for hook in _hooks:
+            hook(path, stats)
+
+    def to_json(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        totals = Stats()
+        blocks = []
+        for path, stats in self.files.items():
+            for stage, seconds in stats.timings.items():
+                totals.timings[stage] += seconds
+                totals.counts[stage] += stats.counts[stage]
+            blocks.extend((seconds, path, block) for seconds, block in stats.blocks)
+        slowest_files = heapq.nlargest(SLOWEST, self.files.items(), key=lambda item: item[1].total)
+        return {
+            "files": len(self.files),
+            "stages": totals.to_json()["stages"],
+            "slowest_files": [
+                {"path": path, "seconds": stats.total, **stats.to_json()} for path, stats in slowest_files
+            ],
+            "slowest_blocks": [
+                {"path": path, "seconds": seconds, "block": block}
+                for seconds, path, block in heapq.nlargest(SLOWEST, blocks)
+            ],
+            **(extra or {}),
+        }
+
+
+def add_hook(hook: Hook) -> None:
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    _hooks.remove(hook)
+
+
+def has_hooks() -> bool:
+    return bool(_hooks)
+
+
+@contextlib.contextmanager
+def collect(stats: Optional[Stats] = None) -> Iterator[Stats]:
+    """Record every :class:`timer` in this thread or task into ``stats`` until the block exits.
+
+    Work handed to other threads, e.g. an executor passed to :func:`blacken_docs.format_str`, isn't recorded.
+    """
+    collected = stats if stats is not None else Stats()
+    token = _active.set(collected)
+    try:
+        yield collected
+    finally:
+        _active.reset(token)
+
+
+class timer:
+    """Time the enclosed block as ``stage``, a no-op unless stats are being collected."""
+
+    __slots__ = ("stage", "block", "start")
+
+    def __init__(self, stage: str, block: Optional[str] = None):
+        self.stage = stage
+        self.block = block
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        if _active.get() is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        active = _active.get()
+        if active is not None and self.start:
+            active.add(self.stage, time.perf_counter() - self.start, self.block)
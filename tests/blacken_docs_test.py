@@ -1,9 +1,29 @@
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import black
+import pytest
+from click.testing import CliRunner
 
 import blacken_docs
 
 
 BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+# only imported once they are used, not by import blacken_docs
+DEFERRED_MODULES = (
+    'docutils.core',
+    'docutils.parsers.rst',
+    'cProfile',
+    'blacken_docs.client',
+    'blacken_docs.daemon',
+    'blacken_docs.pipeline',
+    'blacken_docs.server',
+)
 
 # fmt: off
 
@@ -335,7 +355,7 @@ def test_integration_syntax_error(tmpdir, capsys):
     )
     assert blacken_docs.main((str(f),))
     out, _ = capsys.readouterr()
-    assert out.startswith(f'{f}:1: code block parse error')
+    assert out.startswith(f'{f}:2:3: code block parse error')
     assert f.read() == (
         '```python\n'
         'f(\n'
@@ -442,3 +462,429 @@ def f():
 '''
     after, _ = blacken_docs.format_str(before, BLACK_MODE)
     assert after == expected
+
+
+def test_integration_workers(tmpdir, capsys):
+    contents = (
+        'hello\n'
+        '\n'
+        '.. code-block:: python\n'
+        '\n'
+        '    f(1,2,3)\n'
+        '\n'
+        'world\n'
+    )
+    serial, parallel = tmpdir.mkdir('serial'), tmpdir.mkdir('parallel')
+    for root in (serial, parallel):
+        root.mkdir('.git')
+        for name in ('c.rst', 'a.rst', 'b.rst'):
+            root.join(name).write(contents)
+
+    assert not blacken_docs.main((str(serial),), standalone_mode=False)
+    serial_out, _ = capsys.readouterr()
+    assert not blacken_docs.main((str(parallel), '--workers=2'), standalone_mode=False)
+    parallel_out, _ = capsys.readouterr()
+
+    assert parallel_out == serial_out.replace(str(serial), str(parallel))
+    for name in ('a.rst', 'b.rst', 'c.rst'):
+        assert parallel.join(name).read() == serial.join(name).read()
+
+
+def test_integration_cache(tmpdir, capsys, monkeypatch):
+    tmpdir.mkdir('.git')
+    tmpdir.join('f.rst').write('hello world\n')
+    assert not blacken_docs.main((str(tmpdir),), standalone_mode=False)
+
+    calls = []
+    real_format_file = blacken_docs._format_file
+
+    def format_file(*args, **kwargs):
+        calls.append(args[0])
+        return real_format_file(*args, **kwargs)
+
+    monkeypatch.setattr(blacken_docs, '_format_file', format_file)
+    assert not blacken_docs.main((str(tmpdir),), standalone_mode=False)
+    assert calls == []
+    assert not blacken_docs.main((str(tmpdir), '--no-cache'), standalone_mode=False)
+    assert [str(path) for path in calls] == [str(tmpdir.join('f.rst'))]
+
+
+@pytest.mark.parametrize(
+    'src',
+    (
+        'Some text with a `link`_.\n',
+        'Undefined |substitution|.\n',
+        'Title\n===\n',
+        '.. code-block:: python\n\n    f(1, 2, 3)\n\n.. unknown-directive::\n',
+    ),
+)
+def test_format_str_reports_lint_errors(src):
+    restructuredtext_lint = pytest.importorskip('restructuredtext_lint')
+    after, errors = blacken_docs.format_str(src, mode=BLACK_MODE)
+    assert after == src
+    assert [(e.line_number, e.src) for e in errors] == [
+        (e.line, e.astext()) for e in restructuredtext_lint.lint(src)
+    ]
+
+
+def test_format_str_error_position():
+    src = (
+        'Text::\n'
+        '\n'
+        '    f(1,\n'
+        '    2\n'
+        '\n'
+        '.. code-block:: python\n'
+        '\n'
+        '    x = 1\n'
+        '      y = 2\n'
+    )
+    after, errors = blacken_docs.format_str(src, mode=BLACK_MODE)
+    assert after == src
+    assert [(e.line_number, e.column, e.src) for e in errors] == [(4, 6, 'f(1,\n2'), (9, 5, 'x = 1\n  y = 2')]
+
+
+def test_integration_changed_since(tmpdir):
+    contents = (
+        '.. code-block:: python\n'
+        '\n'
+        '    f(1,2,3)\n'
+    )
+    tmpdir.join('changed.rst').write('')
+    tmpdir.join('unchanged.rst').write(contents)
+    git = ('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com')
+    subprocess.run((*git, 'init', '-q'), cwd=str(tmpdir), check=True)
+    subprocess.run((*git, 'add', '.'), cwd=str(tmpdir), check=True)
+    subprocess.run((*git, 'commit', '-qm', 'initial'), cwd=str(tmpdir), check=True)
+    tmpdir.join('changed.rst').write(contents)
+
+    assert not blacken_docs.main((str(tmpdir), '--changed-since=HEAD'), standalone_mode=False)
+    assert tmpdir.join('changed.rst').read() != contents
+    assert tmpdir.join('unchanged.rst').read() == contents
+
+
+def test_integration_changed_since_not_cached(tmpdir):
+    contents = (
+        '```python\n'
+        'f(1,2)\n'
+        '```\n'
+        '\n'
+        '```python\n'
+        'g(1,2)\n'
+        '```\n'
+    )
+    tmpdir.join('f.md').write(contents)
+    git = ('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com')
+    subprocess.run((*git, 'init', '-q'), cwd=str(tmpdir), check=True)
+    subprocess.run((*git, 'add', '.'), cwd=str(tmpdir), check=True)
+    subprocess.run((*git, 'commit', '-qm', 'initial'), cwd=str(tmpdir), check=True)
+    tmpdir.join('f.md').write(contents.replace('g(1,2)', 'g(1,2,3)'))
+
+    blacken_docs.main((str(tmpdir), '--changed-since=HEAD'), standalone_mode=False)
+    assert tmpdir.join('f.md').read() == contents.replace('g(1,2)', 'g(1, 2, 3)')
+    blacken_docs.main((str(tmpdir),), standalone_mode=False)
+    assert tmpdir.join('f.md').read() == contents.replace('f(1,2)', 'f(1, 2)').replace('g(1,2)', 'g(1, 2, 3)')
+
+
+def test_integration_stdin():
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(blacken_docs.main, ('-',), input='returns None\n')
+    assert result.exit_code == 0
+    assert result.stdout == 'returns ``None``'
+
+    result = runner.invoke(blacken_docs.main, ('--check', '-'), input='returns None\n')
+    assert result.exit_code == 1
+    assert result.stdout == ''
+
+
+def test_integration_serve():
+    requests = (
+        json.dumps({'id': 1, 'content': 'returns None\n'}) + '\n'
+        + 'not json\n'
+        + json.dumps({'id': 2, 'content': 'hi\n', 'mode': {'bogus': 1}}) + '\n'
+    )
+    result = CliRunner(mix_stderr=False).invoke(blacken_docs.main, ('--serve',), input=requests)
+    assert result.exit_code == 0
+    responses = [json.loads(line) for line in result.stdout.splitlines()]
+    assert responses[0] == {'id': 1, 'content': 'returns ``None``', 'changed': True, 'errors': []}
+    assert responses[1]['id'] is None and responses[1]['error'].startswith('invalid request')
+    assert responses[2] == {'id': 2, 'error': "ValueError: unknown mode option 'bogus'"}
+
+
+@pytest.mark.parametrize(
+    'src',
+    (
+        pytest.param(f'def f():\n    "{" ".join(["word"] * 30)}"\n', id='would wrap'),
+        pytest.param('def f():\n    """Ends in a backslash \\\\"""\n', id='backslash'),
+        pytest.param('def f():\n    """Use \\\\n to split None."""\n', id='escape'),
+        pytest.param('def f():\n    r"""Raw \\d None."""\n', id='raw'),
+    ),
+)
+def test_format_py_str_docstring_left_alone(src):
+    after, errors = blacken_docs.format_py_str(src, mode=BLACK_MODE)
+    assert (after, errors) == (src, [])
+
+
+def test_integration_py_file_is_not_imported(tmpdir):
+    f = tmpdir.join('f.py')
+    f.write(
+        'import sys\n'
+        'sys.exit("imported")\n'
+        '\n'
+        '\n'
+        'def f():\n'
+        '    """Returns None"""\n'
+    )
+    assert not blacken_docs.main((str(f),), standalone_mode=False)
+    assert f.read() == (
+        'import sys\n'
+        '\n'
+        'sys.exit("imported")\n'
+        '\n'
+        '\n'
+        'def f():\n'
+        '    """Returns ``None``"""\n'
+    )
+
+
+def test_integration_stats(tmpdir):
+    f = tmpdir.join('f.rst')
+    f.write('Returns None\n')
+    stats_file = tmpdir.join('stats.json')
+    assert not blacken_docs.main((str(f), '--stats', str(stats_file)), standalone_mode=False)
+    summary = json.loads(stats_file.read())
+    assert summary['files'] == 1
+    assert summary['slowest_files'][0]['path'] == str(f)
+    assert 'parse' in summary['stages']
+    assert 'block_cache' in summary
+
+
+def test_import_defers_modules():
+    # a fresh interpreter, this one has imported everything already
+    proc = subprocess.run(
+        (sys.executable, '-c', 'import sys, blacken_docs; print("\\n".join(sys.modules))'),
+        stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    imported = set(proc.stdout.splitlines())
+    assert 'blacken_docs' in imported
+    assert not imported & set(DEFERRED_MODULES)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime is new in 3.7')
+def test_import_time():
+    command = (sys.executable, '-X', 'importtime', '-c', 'import blacken_docs')
+    subprocess.run(command, stderr=subprocess.DEVNULL, check=True)  # writes __pycache__ if it's missing
+    proc = subprocess.run(command, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    cumulative = {}
+    for line in proc.stderr.splitlines()[1:]:  # the first line is the header
+        _, microseconds, name = line.split('|')
+        cumulative.setdefault(name.strip(), int(microseconds))
+    # our own share, black is imported for the command line options anyway; about 100 ms here, 5x for slow machines
+    assert cumulative['blacken_docs'] - cumulative['black'] < 500_000
+
+
+def test_integration_markdown(tmpdir):
+    f = tmpdir.join('README.md')
+    f.write('# Title\n\n```python\nf(1,2,3)\n```\n')
+    tmpdir.join('notes.txt').write('```python\nf(1,2,3)\n```\n')
+    blacken_docs.main((str(tmpdir),), standalone_mode=False)
+    assert f.read() == '# Title\n\n```python\nf(1, 2, 3)\n```\n'
+    assert tmpdir.join('notes.txt').read() == '```python\nf(1,2,3)\n```\n'
+
+
+def test_integration_latex(tmpdir):
+    f = tmpdir.join('book.tex')
+    f.write('\\begin{minted}{python}\nf(1,2,3)\n\\end{minted}\n')
+    blacken_docs.main((str(tmpdir),), standalone_mode=False)
+    assert f.read() == '\\begin{minted}{python}\nf(1, 2, 3)\n\\end{minted}\n'
+
+
+def test_format_str_executor():
+    src = 'Title\n=====\n\nReturns None\n\n.. code-block:: python\n\n    f(1,2,3)\n'
+    with ThreadPoolExecutor(2) as executor:
+        assert blacken_docs.format_str(src, mode=BLACK_MODE, executor=executor) == blacken_docs.format_str(
+            src, mode=BLACK_MODE,
+        )
+
+
+def test_integration_stream_threshold(tmpdir):
+    src = 'One\n===\n\nReturns None\n\nTwo\n===\n\nReturns int\n'
+    streamed, whole = tmpdir.join('streamed.rst'), tmpdir.join('whole.rst')
+    streamed.write(src)
+    whole.write(src)
+    blacken_docs.main((str(streamed), '--stream-threshold', '0', '--no-cache'), standalone_mode=False)
+    blacken_docs.main((str(whole), '--no-cache'), standalone_mode=False)
+    assert streamed.read() == whole.read() != src
+    assert sorted(tmpdir.listdir()) == [streamed, whole]
+
+
+def test_integration_check_exit_code(tmpdir):
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2)\n```\n')
+    result = CliRunner(mix_stderr=False).invoke(blacken_docs.main, (str(f), '--check', '--no-cache'))
+    assert result.exit_code == 1
+    assert f.read() == '```python\nf(1,2)\n```\n'
+    f.write('```python\nf(1, 2)\n```\n')
+    result = CliRunner(mix_stderr=False).invoke(blacken_docs.main, (str(f), '--check', '--no-cache'))
+    assert result.exit_code == 0
+
+
+def test_format_many_sources(tmpdir):
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2)\n```\n')
+    sources = [
+        blacken_docs.Source(pathlib.Path('a.md'), '```python\nf(1, 2)\n```\n'),
+        blacken_docs.Source(pathlib.Path('b.md'), '```python\nf(1,\n```\n'),
+        pathlib.Path(str(f)),
+    ]
+    results = {r.path.name: r for r in blacken_docs.format_many(sources, BLACK_MODE)}
+    assert results['a.md'].changed is black.Changed.NO
+    assert results['a.md'].content == '```python\nf(1, 2)\n```\n'
+    assert results['b.md'].changed is black.Changed.NO
+    assert [error.src for error in results['b.md'].errors] == ['f(1,\n']
+    assert results['f.md'].changed is black.Changed.YES
+    assert results['f.md'].content == f.read() == '```python\nf(1, 2)\n```\n'
+
+
+def test_format_many_check_does_not_write(tmpdir):
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2)\n```\n')
+    result, = blacken_docs.format_many([pathlib.Path(str(f))], BLACK_MODE, check=True)
+    assert result.changed is black.Changed.YES
+    assert result.content == '```python\nf(1, 2)\n```\n'
+    assert f.read() == '```python\nf(1,2)\n```\n'
+
+
+def test_format_many_cache(tmpdir, monkeypatch):
+    monkeypatch.setenv('BLACKEN_DOCS_CACHE_DIR', str(tmpdir))
+    cache = blacken_docs.Cache.read(BLACK_MODE)
+    source = blacken_docs.Source(pathlib.Path('a.md'), '```python\nf(1,2)\n```\n')
+    result, = blacken_docs.format_many([source], BLACK_MODE, cache=cache)
+    assert result.changed is black.Changed.YES
+    result, = blacken_docs.format_many([source._replace(content=result.content)], BLACK_MODE, cache=cache)
+    assert result.changed is black.Changed.CACHED
+    assert result.content == '```python\nf(1, 2)\n```\n'
+
+
+def test_integration_stream_threshold_error(tmpdir, capsys):
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2\n```\n')
+    blacken_docs.main((str(f), '--stream-threshold', '0', '--no-cache'), standalone_mode=False)
+    assert f.read() == '```python\nf(1,2\n```\n'
+    assert f'{f}:2:6: code block parse error' in capsys.readouterr().err
+    assert tmpdir.listdir() == [f]
+
+
+def test_integration_diff_only(tmpdir, capsys):
+    f = tmpdir.join('f.md')
+    f.write('# Title\n\n```python\nf(1,2,3)\n```\n')
+    blacken_docs.main((str(f), '--diff-only'), standalone_mode=False)
+    assert f.read() == '# Title\n\n```python\nf(1,2,3)\n```\n'
+    assert capsys.readouterr().out == (
+        f'--- {f}\n'
+        f'+++ {f}\n'
+        '@@ -1,5 +1,5 @@\n'
+        ' # Title\n'
+        ' \n'
+        ' ```python\n'
+        '-f(1,2,3)\n'
+        '+f(1, 2, 3)\n'
+        ' ```\n'
+    )
+
+
+def test_integration_preserve_mtime(tmpdir):
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2,3)\n```\n')
+    os.utime(str(f), (1, 1))
+    blacken_docs.main((str(f), '--preserve-mtime', '--no-cache'), standalone_mode=False)
+    assert f.read() == '```python\nf(1, 2, 3)\n```\n'
+    assert os.stat(str(f)).st_mtime == 1
+    assert tmpdir.listdir() == [f]
+
+
+def test_integration_async_io(tmpdir):
+    for i in range(5):
+        tmpdir.join(f'f{i}.md').write('```python\nf(1,2,3)\n```\n')
+    blacken_docs.main((str(tmpdir), '--async-io', '--no-cache'), standalone_mode=False)
+    assert {f.read() for f in tmpdir.listdir()} == {'```python\nf(1, 2, 3)\n```\n'}
+
+
+def test_integration_async_io_reports_in_main_thread(tmpdir, monkeypatch):
+    monkeypatch.setenv('BLACKEN_DOCS_CACHE_DIR', str(tmpdir.join('cache')))
+    docs = tmpdir.join('docs')
+    docs.join('.gitignore').write('ignored.md\n', ensure=True)
+    docs.join('ignored.md').write('```python\nf(1,2)\n```\n')
+    for i in range(3):
+        docs.join(f'f{i}.md').write('```python\nf(1, 2)\n```\n')
+    blacken_docs.main((str(docs), '--async-io'), standalone_mode=False)  # the second run finds them cached
+    threads = []
+    for method in ('done', 'path_ignored'):
+        monkeypatch.setattr(
+            black.Report,
+            method,
+            lambda self, *args, method=method: threads.append((method, threading.current_thread())),
+        )
+    blacken_docs.main((str(docs), '--async-io'), standalone_mode=False)
+    assert sorted(method for method, _ in threads) == ['done'] * 3 + ['path_ignored']
+    assert {thread for _, thread in threads} == {threading.main_thread()}
+
+
+def test_integration_incremental(tmpdir, monkeypatch):
+    src = 'One\n===\n\nReturns None\n\nTwo\n===\n\nReturns int\n'
+    f = tmpdir.join('f.rst')
+    f.write(src)
+    blacken_docs.main((str(f), '--incremental'), standalone_mode=False)
+    assert f.read() == blacken_docs.format_str(src, mode=BLACK_MODE)[0]
+
+    formatted = []
+    real_format_str = blacken_docs._format_str
+
+    def format_str(src, **kwargs):
+        formatted.append(src)
+        return real_format_str(src, **kwargs)
+
+    monkeypatch.setattr(blacken_docs, '_format_str', format_str)
+    f.write(src.replace('int', 'str'))  # regenerated with one section changed
+    blacken_docs.main((str(f), '--incremental'), standalone_mode=False)
+    assert formatted == ['Two\n===\n\nReturns str\n']
+    assert f.read() == blacken_docs.format_str(src.replace('int', 'str'), mode=BLACK_MODE)[0]
+
+
+def test_integration_incremental_in_place(tmpdir, monkeypatch):
+    f = tmpdir.join('f.rst')
+    f.write('Intro.\n\nOne\n===\n\nReturns None\n\nSub\n---\n\nText.\n\nTwo\n===\n\nReturns int\n')
+    blacken_docs.main((str(f), '--incremental'), standalone_mode=False)
+    assert f.read() == 'Intro.\n\nOne\n===\n\nReturns ``None``\n\nSub\n---\n\nText.\n\nTwo\n===\n\nReturns ``int``'
+
+    formatted = []
+    real_format_str = blacken_docs._format_str
+
+    def format_str(src, **kwargs):
+        formatted.append(src)
+        return real_format_str(src, **kwargs)
+
+    monkeypatch.setattr(blacken_docs, '_format_str', format_str)
+    f.write(f.read().replace('``int``', 'str'))  # edited after it was formatted in place
+    blacken_docs.main((str(f), '--incremental'), standalone_mode=False)
+    assert formatted == ['Two\n===\n\nReturns str']
+    assert f.read().endswith('Two\n===\n\nReturns ``str``')
+
+
+def test_integration_error_format_json(tmpdir, capsys):
+    f = tmpdir.join('f.md')
+    f.write('text\n\n```python\nx = 1\nf(1,\n```\n')
+    blacken_docs.main((str(f), '--error-format', 'json', '--no-cache'), standalone_mode=False)
+    out, _ = capsys.readouterr()
+    assert json.loads(out) == [
+        {'path': str(f), 'line': 5, 'column': 5, 'message': 'Cannot parse: 3:0: EOF in multi-line statement'},
+    ]
+
+
+def test_integration_error_format_json_py_file(tmpdir, capsys):
+    f = tmpdir.join('f.py')
+    f.write('x = 1\n\n\ndef f():\n    pass\nf(1,, 2)\n')
+    blacken_docs.main((str(f), '--error-format', 'json', '--no-cache'), standalone_mode=False)
+    out, _ = capsys.readouterr()
+    (error,) = json.loads(out)
+    assert (error['line'], error['column']) == (6, 5)
@@ -0,0 +1,82 @@
+import pathlib
+
+import black
+
+from blacken_docs.cache import Cache, SectionIndex, digest, digest_file
+
+
+BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+
+
+def test_cache_roundtrip(tmpdir):
+    f = tmpdir.join('f.rst')
+    f.write('hello\n')
+    path = pathlib.Path(str(f))
+
+    cache = Cache.read(BLACK_MODE)
+    assert not cache.is_formatted(path)
+    cache.mark_formatted(path)
+    cache.write()
+
+    cache = Cache.read(BLACK_MODE)
+    assert cache.is_formatted(path)
+    f.write('changed\n')
+    assert not cache.is_formatted(path)
+
+
+def test_cache_keyed_on_mode():
+    other = black.FileMode(line_length=42)
+    assert Cache.read(BLACK_MODE).path != Cache.read(other).path
+
+
+def test_cache_evicts_least_recently_seen(tmpdir):
+    cache = Cache.read(BLACK_MODE, max_entries=2)
+    cache.entries = {'a': 1.0, 'b': 3.0, 'c': 2.0}
+    cache.write()
+    assert Cache.read(BLACK_MODE).entries == {'b': 3.0, 'c': 2.0}
+
+
+def test_cache_corrupt_file_is_ignored():
+    cache = Cache.read(BLACK_MODE)
+    cache.path.parent.mkdir(parents=True)
+    cache.path.write_bytes(b'not a pickle')
+    assert Cache.read(BLACK_MODE).entries == {}
+
+
+def test_digest_file(tmpdir):
+    f = tmpdir.join('f.rst')
+    f.write_binary(b'hello\n' * 1000)
+    assert digest_file(pathlib.Path(str(f)), block_size=64) == digest(b'hello\n' * 1000)
+    assert digest_file(pathlib.Path(str(f)), block_size=64, suffix='.rst') == digest(b'hello\n' * 1000, suffix='.rst')
+
+
+def test_cache_keyed_on_file_type(tmpdir):
+    md, rst = tmpdir.join('x.md'), tmpdir.join('y.rst')
+    md.write('Returns None\n')
+    rst.write('Returns None\n')
+    cache = Cache.read(BLACK_MODE)
+    cache.mark_formatted(pathlib.Path(str(md)))
+    assert not cache.is_formatted(pathlib.Path(str(rst)))
+    cache.mark_formatted_contents('Returns None\n', pathlib.Path('x.md'))
+    assert not cache.is_formatted_contents('Returns None\n', pathlib.Path('y.rst'))
+    assert cache.is_formatted_contents('Returns None\n', pathlib.Path('z.md'))
+
+
+def test_section_index(tmpdir):
+    path = pathlib.Path(str(tmpdir.join('f.rst')))
+    index = SectionIndex.read(path, BLACK_MODE)
+    assert index.get('One\n===\n') is None
+    index.add('One\n===\n', 'One\n===')
+    index.write()
+
+    index = SectionIndex.read(path, BLACK_MODE)
+    assert index.get('One\n===\n') == 'One\n==='
+    index.add('Two\n===\n', 'Two\n===')
+    index.write()
+    # only the sections of the last run are kept
+    assert SectionIndex.read(path, BLACK_MODE).entries == {
+        digest('One\n==='): 'One\n===',
+        digest('Two\n==='): 'Two\n===',
+    }
+    assert SectionIndex.read(path, BLACK_MODE).get('\nOne\n===\n\n') == 'One\n==='
+    assert SectionIndex.read(path, black.FileMode(line_length=42)).entries == {}
@@ -0,0 +1,88 @@
+import pathlib
+import subprocess
+
+import pytest
+
+from blacken_docs.changes import changed_lines, intersects, parse_diff
+
+
+def git(*args, cwd):
+    subprocess.run(
+        ('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args),
+        cwd=str(cwd), check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+@pytest.fixture
+def repo(tmpdir):
+    git('init', '-q', cwd=tmpdir)
+    tmpdir.join('a.rst').write('one\ntwo\nthree\n')
+    tmpdir.join('b.py').write('x = 1\ny = 2\n')
+    tmpdir.join('c.txt').write('ignored\n')
+    git('add', '.', cwd=tmpdir)
+    git('commit', '-qm', 'initial', cwd=tmpdir)
+    return tmpdir
+
+
+def test_parse_diff():
+    diff = (
+        'diff --git a/a.rst b/a.rst\n'
+        '--- a/a.rst\n'
+        '+++ b/a.rst\n'
+        '@@ -2 +2 @@\n'
+        '@@ -5,0 +6,3 @@\n'
+        '@@ -9,2 +11,0 @@\n'
+    )
+    root = pathlib.Path('/root')
+    assert parse_diff(diff, root) == {root / 'a.rst': [(2, 2), (6, 8)]}
+
+
+def test_changed_lines(repo):
+    repo.join('a.rst').write('one\nTWO\nthree\nfour\n')
+    repo.join('b.py').write('x = 1\n')
+    repo.join('c.txt').write('changed\n')
+    repo.join('d.rst').write('untracked\n')
+
+    root = pathlib.Path(str(repo)).resolve()
+    assert changed_lines('HEAD', root) == {root / 'a.rst': [(2, 2), (4, 4)], root / 'd.rst': None}
+
+
+def test_parse_diff_quoted_names():
+    diff = (
+        '+++ b/my doc.rst\t\n'
+        '@@ -1 +1 @@\n'
+        '+++ "b/tab\\there.rst"\n'
+        '@@ -1 +1 @@\n'
+        '+++ "b/caf\\303\\251.rst"\n'
+        '@@ -1 +1 @@\n'
+    )
+    root = pathlib.Path('/root')
+    assert parse_diff(diff, root) == {
+        root / 'my doc.rst': [(1, 1)],
+        root / 'tab\there.rst': [(1, 1)],
+        root / 'caf\u00e9.rst': [(1, 1)],
+    }
+
+
+def test_changed_lines_file_name_with_space(repo):
+    repo.join('my doc.rst').write('one\n')
+    git('add', '.', cwd=repo)
+    git('commit', '-qm', 'space', cwd=repo)
+    repo.join('my doc.rst').write('ONE\n')
+
+    root = pathlib.Path(str(repo)).resolve()
+    assert changed_lines('HEAD', root) == {root / 'my doc.rst': [(1, 1)]}
+
+
+def test_changed_lines_noprefix(repo):
+    git('config', 'diff.noprefix', 'true', cwd=repo)
+    repo.join('a.rst').write('one\nTWO\nthree\n')
+
+    root = pathlib.Path(str(repo)).resolve()
+    assert changed_lines('HEAD', root) == {root / 'a.rst': [(2, 2)]}
+
+
+def test_intersects():
+    assert intersects(1, 3, None)
+    assert intersects(1, 3, [(3, 5)])
+    assert not intersects(1, 3, [(4, 5)])
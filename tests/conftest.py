@@ -0,0 +1,6 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setenv('BLACKEN_DOCS_CACHE_DIR', str(tmpdir.join('.cache')))
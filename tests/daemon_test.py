@@ -0,0 +1,109 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+import blacken_docs
+from blacken_docs import daemon
+from blacken_docs.client import Client, find_daemon, parse_address
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+
+
+def start_daemon(address, idle_timeout=0):
+    ready = threading.Event()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(
+        target=loop.run_until_complete,
+        args=(daemon.run(address, idle_timeout=idle_timeout, ready=ready.set),),
+        daemon=True,
+    )
+    thread.start()
+    assert ready.wait(10)
+    return thread
+
+
+@pytest.fixture
+def address(tmpdir):
+    address = str(tmpdir.join('d.sock'))
+    start_daemon(address)
+    return address
+
+
+def test_parse_address():
+    assert parse_address('localhost:8080') == ('localhost', 8080)
+    assert parse_address('[::1]:8080') == ('::1', 8080)
+    assert parse_address('/tmp/daemon.sock') == '/tmp/daemon.sock'
+
+
+def test_daemon_ping(address):
+    with Client(address) as client:
+        response = client.request({'op': 'ping'})
+    assert response['status'] == 'ok'
+    assert response['version'] == blacken_docs.__version__
+
+
+def test_daemon_format(address):
+    requests = [
+        {'path': 'f.md', 'content': f'```python\nf({i},2)\n```\n', 'mode': {'line_length': 79}}
+        for i in range(50)
+    ]
+    requests.append({'op': 'check', 'content': 'Returns None\n'})
+    requests.append({'op': 'bogus', 'content': ''})
+    with Client(address) as client:
+        responses = {response['id']: response for response in client.map(requests, window=4)}
+    assert responses[7]['content'] == '```python\nf(6, 2)\n```\n'
+    assert responses[51] == {'id': 51, 'changed': True, 'errors': []}
+    assert responses[52] == {'id': 52, 'error': "ValueError: unknown op 'bogus'"}
+
+
+def test_find_daemon(tmpdir, address):
+    assert find_daemon(str(tmpdir.join('missing.sock'))) is None
+    client = find_daemon(address)
+    assert client is not None
+    client.close()
+
+
+def test_find_daemon_other_version(address, monkeypatch):
+    monkeypatch.setattr(blacken_docs.client, '__version__', '0.0.0')
+    assert find_daemon(address) is None
+
+
+def test_daemon_already_running(address):
+    with pytest.raises(blacken_docs.client.DaemonError):
+        asyncio.new_event_loop().run_until_complete(daemon.run(address))
+
+
+def test_daemon_idle_timeout(tmpdir):
+    address = str(tmpdir.join('d.sock'))
+    thread = start_daemon(address, idle_timeout=0.1)
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not tmpdir.join('d.sock').exists()
+
+
+def test_integration_daemon(tmpdir, address, monkeypatch):
+    monkeypatch.setenv('BLACKEN_DOCS_DAEMON', address)
+    monkeypatch.setattr(blacken_docs, '_format_file', None)  # nothing is formatted in this process
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2,3)\n```\n')
+    blacken_docs.main((str(f), '--no-cache'), standalone_mode=False)
+    assert f.read() == '```python\nf(1, 2, 3)\n```\n'
+
+
+def test_integration_daemon_check(tmpdir, address, monkeypatch):
+    monkeypatch.setenv('BLACKEN_DOCS_DAEMON', address)
+    monkeypatch.setattr(blacken_docs, '_format_file', None)
+    f = tmpdir.join('f.md')
+    f.write('```python\nf(1,2,3)\n```\n')
+    result = CliRunner(mix_stderr=False).invoke(blacken_docs.main, (str(f), '--check'))
+    assert result.exit_code == 1
+    assert 'would reformat' in result.stderr
+    assert f.read() == '```python\nf(1,2,3)\n```\n'
+
+    monkeypatch.undo()  # and it wasn't remembered as formatted either
+    result = CliRunner(mix_stderr=False).invoke(blacken_docs.main, (str(f), '--check', '--no-daemon'))
+    assert result.exit_code == 1
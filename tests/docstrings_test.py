@@ -0,0 +1,47 @@
+from blacken_docs.docstrings import find_docstrings, splice
+
+
+SOURCE = '''\
+"""Module."""
+
+
+class A:
+    r\'\'\'Class.
+
+    More.
+    \'\'\'
+
+    def f(self, x="not a docstring"): "One liner."
+
+    async def g(self):
+        x = "not a docstring either"
+
+    def h():
+        "implicitly" "concatenated"
+'''
+
+
+def test_find_docstrings():
+    docstrings = find_docstrings(SOURCE)
+    assert [(d.lineno, d.end_lineno, d.indent, d.prefix, d.body) for d in docstrings] == [
+        (1, 1, 0, '"""', 'Module.'),
+        (5, 8, 4, "r'''", 'Class.\n\n    More.\n    '),
+        (10, 10, 4, '"', 'One liner.'),
+    ]
+    assert [SOURCE[d.start:d.end] for d in docstrings] == [
+        '"""Module."""',
+        "r'''Class.\n\n    More.\n    '''",
+        '"One liner."',
+    ]
+
+
+def test_find_docstrings_non_ascii_before_docstring():
+    source = 'def f(x="é"): "doc"\n'
+    (docstring,) = find_docstrings(source)
+    assert source[docstring.start:docstring.end] == '"doc"'
+
+
+def test_splice():
+    docstrings = find_docstrings(SOURCE)
+    new = splice(SOURCE, [(docstrings[2], 'Two.'), (docstrings[0], 'One.')])
+    assert new == SOURCE.replace('"""Module."""', '"""One."""').replace('"One liner."', '"Two."')
@@ -0,0 +1,44 @@
+import pytest
+
+from blacken_docs import doctests
+from blacken_docs.doctests import Example
+
+
+def test_parse():
+    src = (
+        'text\n'
+        '  >>> def f(a):\n'
+        '  ...     return a\n'
+        '  ...\n'
+        '  >>> f(1)\n'
+        '  1\n'
+    )
+    assert doctests.parse(src) == [
+        'text\n',
+        Example('  ', 'def f(a):\n    return a\n', 1, '\n', '  >>> def f(a):\n  ...     return a\n  ...\n'),
+        Example('  ', 'f(1)\n', 0, '\n', '  >>> f(1)\n'),
+        '  1\n',
+    ]
+
+
+@pytest.mark.parametrize(
+    'src',
+    (
+        '>>>\n',
+        '>>> for i in x:\n...print(i)\n',
+        '>>> for i in x:\n  ...     print(i)\n',
+    ),
+)
+def test_parse_leaves_invalid_examples(src):
+    assert ''.join(doctests.parse(src)) == src
+    assert not any(isinstance(part, Example) for part in doctests.parse(src))
+
+
+def test_render():
+    example = Example('    ', 'def f():\n    pass\n', 1, '', '')
+    assert doctests.render(example, 'def f():\n\n    pass\n') == (
+        '    >>> def f():\n'
+        '    ...\n'
+        '    ...     pass\n'
+        '    ...'
+    )
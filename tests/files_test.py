@@ -0,0 +1,67 @@
+import pathlib
+import re
+
+import pytest
+
+from blacken_docs.files import DEFAULT_EXCLUDES, DEFAULT_INCLUDES, is_included, iter_files
+
+
+INCLUDE = re.compile(DEFAULT_INCLUDES)
+EXCLUDE = re.compile(DEFAULT_EXCLUDES)
+
+
+@pytest.fixture
+def tree(tmpdir):
+    for name in (
+        'index.rst',
+        'notes.txt',
+        'docs/a.rst',
+        'docs/b.py',
+        'docs.rst/c.rst',
+        'docs/generated/d.rst',
+        'docs/keep/e.rst',
+        'docs/keep/skip.rst',
+        'build/f.rst',
+        '.tox/g.rst',
+        'node_modules/h.rst',
+    ):
+        tmpdir.join(name).ensure()
+    tmpdir.join('.gitignore').write('generated/\n')
+    tmpdir.join('docs/keep/.gitignore').write('skip.rst\n')
+    return pathlib.Path(str(tmpdir))
+
+
+def relative(paths, root):
+    return [path.relative_to(root).as_posix() for path in paths]
+
+
+def test_iter_files(tree):
+    assert relative(iter_files([tree], tree, INCLUDE, EXCLUDE), tree) == [
+        'index.rst',
+        'docs/a.rst',
+        'docs/b.py',
+        'docs/keep/e.rst',
+        'docs.rst/c.rst',
+        'node_modules/h.rst',
+    ]
+
+
+def test_iter_files_extend_exclude_and_no_gitignore(tree):
+    files = iter_files([tree / 'docs'], tree, INCLUDE, EXCLUDE, re.compile('/keep/'), gitignore=False)
+    assert relative(files, tree) == ['docs/a.rst', 'docs/b.py', 'docs/generated/d.rst']
+
+
+def test_iter_files_explicit_files_always_included(tree):
+    files = iter_files([tree / 'notes.txt', tree / 'build'], tree, INCLUDE, EXCLUDE)
+    assert relative(files, tree) == ['notes.txt']
+
+
+def test_iter_files_is_lazy(tree):
+    files = iter_files([tree], tree, INCLUDE, EXCLUDE)
+    assert relative([next(files)], tree) == ['index.rst']
+
+
+def test_is_included(tree):
+    assert is_included(tree / 'docs/a.rst', tree, INCLUDE, EXCLUDE)
+    assert not is_included(tree / 'build/f.rst', tree, INCLUDE, EXCLUDE)
+    assert not is_included(tree / 'notes.txt', tree, INCLUDE, EXCLUDE)
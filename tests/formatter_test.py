@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import black
+import pytest
+
+from blacken_docs import formatter
+
+
+BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+
+
+@pytest.fixture
+def block_cache():
+    return formatter.BlockCache(maxsize=2)
+
+
+def test_block_cache_hits(block_cache):
+    assert block_cache.format('f(1,2,3)\n', mode=BLACK_MODE) == 'f(1, 2, 3)\n'
+    assert block_cache.format('f(1,2,3)\n', mode=BLACK_MODE) == 'f(1, 2, 3)\n'
+    assert block_cache.info() == formatter.BlockCacheInfo(hits=1, misses=1, maxsize=2, currsize=1)
+
+
+def test_block_cache_keyed_on_mode(block_cache):
+    code = 'foo(very_very_very_very_very_very_very, long_long_long_long_long)\n'
+    assert block_cache.format(code, mode=BLACK_MODE) == code
+    assert block_cache.format(code, mode=black.FileMode(line_length=50)) != code
+    assert block_cache.info().misses == 2
+
+
+def test_block_cache_invalid_input(block_cache):
+    for _ in range(2):
+        with pytest.raises(black.InvalidInput):
+            block_cache.format('hello world\n', mode=BLACK_MODE)
+    assert block_cache.info().hits == 1
+
+
+def test_block_cache_evicts_least_recently_used(block_cache):
+    block_cache.format('a\n', mode=BLACK_MODE)
+    block_cache.format('b\n', mode=BLACK_MODE)
+    block_cache.format('a\n', mode=BLACK_MODE)
+    block_cache.format('c\n', mode=BLACK_MODE)
+    block_cache.format('a\n', mode=BLACK_MODE)
+    block_cache.format('b\n', mode=BLACK_MODE)
+    assert block_cache.info() == formatter.BlockCacheInfo(hits=2, misses=4, maxsize=2, currsize=2)
+
+
+def test_block_cache_persisted(block_cache, tmpdir):
+    path = str(tmpdir.join('blocks.pickle'))
+    block_cache.format('f(1,2,3)\n', mode=BLACK_MODE)
+    block_cache.dump(path)
+
+    other = formatter.BlockCache()
+    other.load(path)
+    assert other.format('f(1,2,3)\n', mode=BLACK_MODE) == 'f(1, 2, 3)\n'
+    assert other.info().hits == 1
+
+
+def test_generate_doc_reuses_settings():
+    first = formatter.generate_doc('hello\n')
+    second = formatter.generate_doc('.. code-block:: python\n\n    f(1, 2, 3)\n')
+    assert first.settings is second.settings
+    assert first.astext() == 'hello'
+    assert second.children[0].astext() == 'f(1, 2, 3)'
+
+
+def test_generate_doc_threads():
+    sources = [f'paragraph {i}\n\n    quoted {i}\n' for i in range(50)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        docs = list(executor.map(formatter.generate_doc, sources))
+    assert [doc.astext() for doc in docs] == [f'paragraph {i}\n\nquoted {i}' for i in range(50)]
+
+
+@pytest.mark.parametrize(
+    ('src', 'expected'),
+    (
+        ('returns None', 'returns ``None``'),
+        ('returns None.', 'returns ``None``'),
+        ('a None\nb', 'a ``None`` b'),
+        ('a None.\nb', 'a ``None``\nb'),
+        ('NoneType or Nonesuch', '``NoneType`` or Nonesuch'),
+        ('raises ValueError, or 42', 'raises ``ValueError`` or ``42``'),
+        ('`None` and ``int``', '``None`` and ``int``'),
+        ('`not a name`', '`not a name`'),
+        ('`a` or `abc`', '`a` or ``abc``'),
+        ('int`', '``int``'),
+    ),
+)
+def test_fix_inline(src, expected):
+    assert formatter.fix_inline(src) == expected
+
+
+def test_block_cache_format_many(block_cache):
+    results = block_cache.format_many(['f(1,2)\n', 'hello world\n', 'f(1,2)\n'], mode=BLACK_MODE)
+    assert results[0] == results[2] == 'f(1, 2)\n'
+    assert isinstance(results[1], black.InvalidInput)
+    assert block_cache.info() == formatter.BlockCacheInfo(hits=1, misses=2, maxsize=2, currsize=2)
+
+
+def test_block_cache_format_many_executor(block_cache):
+    codes = [f'f({i},{i})\n' for i in range(4)]
+    with ThreadPoolExecutor(2) as executor:
+        results = block_cache.format_many(codes, mode=BLACK_MODE, executor=executor)
+    assert results == [f'f({i}, {i})\n' for i in range(4)]
+    assert block_cache.info().currsize == 2
+
+
+def test_block_cache_shared_between_threads(block_cache):
+    codes = [f'f({i % 3},{i % 3})\n' for i in range(300)]
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda code: block_cache.format(code, mode=BLACK_MODE), codes))
+    assert results == [code.replace(',', ', ') for code in codes]
+    info = block_cache.info()
+    assert info.hits + info.misses == len(codes)
+    assert info.currsize == 2
+
+
+@pytest.mark.parametrize(
+    ('code', 'expected'),
+    (
+        ('f(1,2,3)\n', True),
+        ('    x = 1\n    y = 2\n', True),
+        ('print "hello"\n', False),
+        ('Returns the value.\n', False),
+        ('``None``\n', False),
+        ('"\\d"\n', True),
+    ),
+)
+def test_is_python(code, expected):
+    assert formatter.is_python(code) is expected
+
+
+def test_format_doctest():
+    src = (
+        '>>> import os\n'
+        '>>> x=os.path.join( "a","b" )\n'
+        '>>> def f( a ):\n'
+        '...     return a\n'
+        '...\n'
+        '>>> f( x )\n'
+        "'a/b'\n"
+        '>>> a=1;b=2\n'
+        '>>> print "hello"\n'
+        '>>> import os\n'
+    )
+    formatter.block_cache.clear()
+    assert formatter.format_doctest(src, mode=BLACK_MODE) == (
+        '>>> import os\n'
+        '>>> x = os.path.join("a", "b")\n'
+        '>>> def f(a):\n'
+        '...     return a\n'
+        '...\n'
+        '>>> f(x)\n'
+        "'a/b'\n"
+        '>>> a=1;b=2\n'
+        '>>> print "hello"\n'
+        '>>> import os\n'
+    )
+    assert formatter.block_cache.info().hits == 1
+
+
+def test_blacken_code_blocks_doctest():
+    assert formatter.blacken_code_blocks('  >>> f(1,2)\n  3\n', mode=BLACK_MODE) == '    >>> f(1, 2)\n    3\n'
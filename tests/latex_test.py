@@ -0,0 +1,55 @@
+import itertools
+
+import black
+import pytest
+
+from blacken_docs.latex import format_latex, iter_latex
+
+
+BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+
+
+@pytest.mark.parametrize(
+    ('src', 'expected'),
+    (
+        (
+            'hello\n\\begin{minted}{python}\nf(1,2,3)\n\\end{minted}\nworld!',
+            'hello\n\\begin{minted}{python}\nf(1, 2, 3)\n\\end{minted}\nworld!',
+        ),
+        (
+            'hello\n  \\begin{minted}{python}\n    if True:\n      f(1,2,3)\n  \\end{minted}\nworld!',
+            'hello\n  \\begin{minted}{python}\n  if True:\n      f(1, 2, 3)\n  \\end{minted}\nworld!',
+        ),
+        (
+            'hello\n\\begin{pyblock}\nf(1,2,3)\n\\end{pyblock}\nworld!',
+            'hello\n\\begin{pyblock}\nf(1, 2, 3)\n\\end{pyblock}\nworld!',
+        ),
+        (
+            '\\begin{pycode}\nf(1,2,3)\n\\end{pycode}\n',
+            '\\begin{pycode}\nf(1, 2, 3)\n\\end{pycode}\n',
+        ),
+        (
+            '\\begin{minted}[linenos]{py3}\nf(1,2,3)\n\\end{minted}\n',
+            '\\begin{minted}[linenos]{py3}\nf(1, 2, 3)\n\\end{minted}\n',
+        ),
+        ('\\begin{minted}{c}\nf(1,2,3);\n\\end{minted}\n', '\\begin{minted}{c}\nf(1,2,3);\n\\end{minted}\n'),
+        ('\\begin{pycode}\nf(1,2,3)\n\\end{pyblock}\n', '\\begin{pycode}\nf(1,2,3)\n\\end{pyblock}\n'),
+    ),
+)
+def test_format_latex(src, expected):
+    assert format_latex(src, mode=BLACK_MODE) == (expected, [])
+
+
+def test_format_latex_error():
+    src = 'hello\n\\begin{minted}{python}\nf(1,\n\\end{minted}\n'
+    after, errors = format_latex(src, mode=BLACK_MODE)
+    assert after == src
+    assert [(error.line_number, error.src) for error in errors] == [(3, 'f(1,\n')]
+
+
+def test_iter_latex_streams():
+    block = ['\\begin{minted}{python}\n', 'f(1,2,3)\n', '\\end{minted}\n', 'text\n']
+    output = iter_latex(itertools.cycle(block), mode=BLACK_MODE, errors=[])
+    assert list(itertools.islice(output, 8)) == [
+        '\\begin{minted}{python}\n', 'f(1, 2, 3)\n', '\\end{minted}\n', 'text\n',
+    ] * 2
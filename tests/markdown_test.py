@@ -0,0 +1,51 @@
+import black
+import pytest
+
+from blacken_docs.markdown import format_markdown
+
+
+BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+
+
+@pytest.mark.parametrize(
+    ('src', 'expected'),
+    (
+        ('```python\nf(1,2,3)\n```\n', '```python\nf(1, 2, 3)\n```\n'),
+        ('```python\nf(1,2,3)\n```    \n', '```python\nf(1, 2, 3)\n```    \n'),
+        (
+            '- do this pls:\n  ```python\n  f(1,2,3)\n  ```\n- also this\n',
+            '- do this pls:\n  ```python\n  f(1, 2, 3)\n  ```\n- also this\n',
+        ),
+        ('~~~ py3 title="x"\nf(1,2,3)\n~~~\n', '~~~ py3 title="x"\nf(1, 2, 3)\n~~~\n'),
+        ('````\n```python\nf(1,2,3)\n```\n````\n', '````\n```python\nf(1,2,3)\n```\n````\n'),
+        ('```js\nf(1,2,3)\n```\n', '```js\nf(1,2,3)\n```\n'),
+        ('```python\nf(1,2,3)\n', '```python\nf(1,2,3)\n'),
+        ('text f(1,2,3)\n```python\n```\n', 'text f(1,2,3)\n```python\n```\n'),
+    ),
+)
+def test_format_markdown(src, expected):
+    assert format_markdown(src, mode=BLACK_MODE) == (expected, [])
+
+
+def test_format_markdown_error():
+    src = 'text\n\n```python\nf(1,\n```\n'
+    after, errors = format_markdown(src, mode=BLACK_MODE)
+    assert after == src
+    assert [(error.line_number, error.src) for error in errors] == [(4, 'f(1,\n')]
+
+
+def test_format_markdown_error_position():
+    src = 'text\n\n  ```python\n  x = 1\n  f(1,\n  ```\n'
+    _, errors = format_markdown(src, mode=BLACK_MODE)
+    assert [(error.line_number, error.column) for error in errors] == [(5, 7)]
+
+
+def test_format_markdown_only_changed_blocks():
+    src = '```python\nf(1,2,3)\n```\n\n```python\ng(1,2,3)\n```\n'
+    after, _ = format_markdown(src, mode=BLACK_MODE, lines=[(6, 6)])
+    assert after == '```python\nf(1,2,3)\n```\n\n```python\ng(1, 2, 3)\n```\n'
+
+
+def test_format_markdown_doctest():
+    src = '```python\n>>> f(1,2)\n3\n```\n'
+    assert format_markdown(src, mode=BLACK_MODE) == ('```python\n>>> f(1, 2)\n3\n```\n', [])
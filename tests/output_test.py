@@ -0,0 +1,38 @@
+import difflib
+import os
+import pathlib
+
+from blacken_docs.output import unified_diff, write_atomic
+
+
+def test_write_atomic(tmpdir):
+    f = tmpdir.join('f.rst')
+    f.write('old\n')
+    os.chmod(str(f), 0o640)
+    os.utime(str(f), (1, 1))
+    write_atomic(pathlib.Path(str(f)), 'new\n', preserve_mtime=True)
+    assert f.read() == 'new\n'
+    assert os.stat(str(f)).st_mode & 0o777 == 0o640
+    assert os.stat(str(f)).st_mtime == 1
+    assert tmpdir.listdir() == [f]
+
+
+def test_unified_diff():
+    a = [f'{i}\n' for i in range(100)]
+    b = [*a[:10], 'ten\n', *a[11:90], 'ninety\n', *a[90:]]
+    assert list(unified_diff(a, b, 'a', 'b')) == list(difflib.unified_diff(a, b, 'a', 'b'))
+
+
+def test_unified_diff_identical():
+    assert list(unified_diff(['a\n', 'b'], ['a\n', 'b'], 'a', 'b')) == []
+
+
+def test_unified_diff_no_newline_at_end():
+    assert list(unified_diff(['a\n', 'b'], ['a\n', 'c\n'], 'a', 'b')) == [
+        '--- a\n',
+        '+++ b\n',
+        '@@ -1,2 +1,2 @@\n',
+        ' a\n',
+        '-b\n\\ No newline at end of file\n',
+        '+c\n',
+    ]
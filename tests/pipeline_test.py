@@ -0,0 +1,52 @@
+import asyncio
+import pathlib
+
+import black
+
+from blacken_docs.pipeline import format_paths, format_paths_async
+
+
+BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+
+
+def test_format_paths_async(tmpdir):
+    paths = []
+    for i in range(20):
+        f = tmpdir.join(f'f{i}.md')
+        f.write(f'```python\nf({i},2)\n```\n')
+        paths.append(pathlib.Path(str(f)))
+    tmpdir.join('bad.md').write_binary(b'\xff\n')
+    paths.append(pathlib.Path(str(tmpdir.join('bad.md'))))
+
+    async def collect():
+        return [result async for result in format_paths_async(paths, BLACK_MODE, workers=2, max_pending=2)]
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(collect())
+    finally:
+        loop.close()
+    assert sorted(result.path for result in results) == sorted(paths)
+    failed = [result for result in results if result.failures]
+    assert [result.path.name for result in failed] == ['bad.md']
+    assert all(result.changed is black.Changed.YES for result in results if not result.failures)
+    assert tmpdir.join('f3.md').read() == '```python\nf(3, 2)\n```\n'
+
+
+def test_format_paths_check(tmpdir):
+    f = tmpdir.join('f.rst')
+    f.write('.. code-block:: python\n\n    f(1,2)\n')
+    results = list(format_paths([pathlib.Path(str(f))], BLACK_MODE, diff=True))
+    assert [result.changed for result in results] == [black.Changed.YES]
+    assert f.read() == '.. code-block:: python\n\n    f(1,2)\n'
+
+
+def test_format_paths_stops_early(tmpdir):
+    paths = []
+    for i in range(10):
+        f = tmpdir.join(f'f{i}.md')
+        f.write('text\n')
+        paths.append(pathlib.Path(str(f)))
+    results = format_paths(paths, BLACK_MODE, max_pending=1)
+    assert next(results).changed is black.Changed.NO
+    results.close()
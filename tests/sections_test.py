@@ -0,0 +1,38 @@
+from blacken_docs.sections import iter_sections
+
+
+def test_iter_sections():
+    src = (
+        'intro\n'
+        '\n'
+        '=====\n'
+        'One\n'
+        '=====\n'
+        '\n'
+        'Sub\n'
+        '---\n'
+        '\n'
+        '=====\n'
+        'Two\n'
+        '=====\n'
+        '\n'
+        'text::\n'
+        '\n'
+        '    Not\n'
+        '    ===\n'
+    )
+    assert list(iter_sections(src.splitlines(True))) == [
+        (1, 'intro\n\n'),
+        (3, '=====\nOne\n=====\n\nSub\n---\n\n'),
+        (10, '=====\nTwo\n=====\n\ntext::\n\n    Not\n    ===\n'),
+    ]
+
+
+def test_iter_sections_top_level_is_the_first_style():
+    src = 'One\n---\n\nSub\n===\n\nTwo\n---\n'
+    assert [lineno for lineno, _ in iter_sections(src.splitlines(True))] == [1, 7]
+
+
+def test_iter_sections_needs_titles():
+    src = 'text\n====\nshort\n==\n\n----------\n\nmore\n'
+    assert list(iter_sections(src.splitlines(True))) == [(1, 'text\n====\nshort\n==\n\n----------\n\nmore\n')]
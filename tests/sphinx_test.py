@@ -0,0 +1,121 @@
+import io
+import sys
+
+import pytest
+
+pytest.importorskip('sphinx')
+
+from sphinx.application import Sphinx  # noqa: E402
+
+from blacken_docs.sphinx import replace_block  # noqa: E402
+
+
+INDEX = '''\
+Title
+=====
+
+.. code-block:: python
+
+    f(1,2)
+
+.. code-block:: python
+
+    f(1, 2)
+
+::
+
+    $ ls -l
+
+.. automodule:: mod
+'''
+
+MOD = '''\
+"""Some module.
+
+::
+
+    x = {'a':1}
+"""
+'''
+
+
+@pytest.fixture(autouse=True)
+def clear_analyzer_cache():
+    # autodoc caches module analyzers by module name for the whole process, every test has its own mod
+    from sphinx.pycode import ModuleAnalyzer
+
+    ModuleAnalyzer.cache.clear()
+    yield
+    ModuleAnalyzer.cache.clear()
+
+
+def build(tmpdir, module_dir=None, **config):
+    src = tmpdir.join('src')
+    module_dir = module_dir or src
+    src.join('index.rst').write(INDEX, ensure=True)
+    module_dir.join('mod.py').write(MOD, ensure=True)
+    src.join('conf.py').write(
+        'import sys\n'
+        f'sys.path.insert(0, {str(module_dir)!r})\n'
+        'extensions = ["sphinx.ext.autodoc", "blacken_docs.sphinx"]\n'
+        + ''.join(f'{key} = {value!r}\n' for key, value in config.items())
+    )
+    warnings = io.StringIO()
+    app = Sphinx(
+        str(src),
+        str(src),
+        str(tmpdir.join('out')),
+        str(tmpdir.join('doctrees')),
+        'html',
+        status=None,
+        warning=warnings,
+        freshenv=True,
+    )
+    try:
+        app.build()
+    finally:
+        sys.modules.pop('mod', None)
+        sys.path.remove(str(module_dir))
+    return src, warnings.getvalue()
+
+
+def test_sphinx_warns(tmpdir):
+    src, warnings = build(tmpdir)
+    assert warnings.count('code block would be reformatted by black') == 2
+    assert src.join('index.rst').read() == INDEX
+    assert src.join('mod.py').read() == MOD
+
+
+def test_sphinx_write(tmpdir):
+    src, _ = build(tmpdir, blacken_docs_write=True)
+    assert src.join('index.rst').read() == INDEX.replace('f(1,2)', 'f(1, 2)')
+    assert src.join('mod.py').read() == MOD.replace("{'a':1}", '{"a": 1}')
+
+
+def test_sphinx_write_two_projects(tmpdir):
+    first, _ = build(tmpdir.join('first'))
+    second, _ = build(tmpdir.join('second'), blacken_docs_write=True)  # with the analyzer of the first one cached
+    assert first.join('mod.py').read() == MOD
+    assert second.join('mod.py').read() == MOD.replace("{'a':1}", '{"a": 1}')
+
+
+def test_sphinx_write_project_root(tmpdir):
+    tmpdir.join('pyproject.toml').write('')
+    build(tmpdir, module_dir=tmpdir.join('lib'), blacken_docs_write=True)
+    assert tmpdir.join('lib', 'mod.py').read() == MOD.replace("{'a':1}", '{"a": 1}')
+
+
+def test_sphinx_write_roots(tmpdir):
+    tmpdir.join('pyproject.toml').write('')
+    src, warnings = build(tmpdir, module_dir=tmpdir.join('lib'), blacken_docs_write=True, blacken_docs_write_roots=[])
+    assert src.join('index.rst').read() == INDEX.replace('f(1,2)', 'f(1, 2)')
+    assert tmpdir.join('lib', 'mod.py').read() == MOD
+    assert 'not rewriting' in warnings
+
+
+def test_replace_block():
+    src = 'Text::\n\n    f(1,2)\n\n        g(3,4)\n'
+    assert replace_block(src, 'f(1,2)\n\n    g(3,4)', 'f(1, 2)\n\n    g(3, 4)') == (
+        'Text::\n\n    f(1, 2)\n\n        g(3, 4)\n'
+    )
+    assert replace_block(src, 'h()', 'h()') is None
@@ -0,0 +1,77 @@
+import threading
+
+import black
+import pytest
+
+import blacken_docs
+from blacken_docs import stats
+
+
+BLACK_MODE = black.FileMode(line_length=black.DEFAULT_LINE_LENGTH)
+
+
+def test_timer_is_a_noop_without_collect():
+    with stats.timer('parse'):
+        pass
+    with stats.collect() as collected:
+        pass
+    assert collected.timings == {}
+
+
+def test_collect_records_stages():
+    with stats.collect() as collected:
+        blacken_docs.format_str('Returns None\n\n.. code-block:: python\n\n    f(1,2,3)\n', mode=BLACK_MODE)
+    assert {'parse', 'walk', 'transforms', 'fix_inline', 'wrap_text'} <= set(collected.timings)
+    assert collected.counts['parse'] == 1
+
+
+@pytest.mark.parametrize('thread_var', (False, True))
+def test_collect_is_per_thread(thread_var, monkeypatch):
+    if thread_var:  # what Python 3.6 gets without contextvars
+        monkeypatch.setattr(stats, '_active', stats._ThreadVar())
+    inside, outside = threading.Event(), threading.Event()
+
+    def other_thread():
+        inside.wait()
+        with stats.timer('parse'):
+            pass
+        outside.set()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    with stats.collect() as collected:
+        inside.set()
+        outside.wait()
+    thread.join()
+    assert collected.timings == {}
+
+
+def test_slowest_blocks_are_bounded():
+    collected = stats.Stats()
+    for i in range(stats.SLOWEST + 5):
+        collected.add('black', float(i), block=f'block_{i}()\nmore()\n')
+    blocks = collected.to_json()['slowest_blocks']
+    assert len(blocks) == stats.SLOWEST
+    assert blocks[0] == {'seconds': float(stats.SLOWEST + 4), 'block': f'block_{stats.SLOWEST + 4}()'}
+
+
+def test_run_stats_hooks():
+    calls = []
+
+    def hook(path, file_stats):
+        calls.append((path, dict(file_stats.timings)))
+
+    file_stats = stats.Stats()
+    file_stats.add('file', 2.0)
+    stats.add_hook(hook)
+    try:
+        run_stats = stats.RunStats()
+        run_stats.add_file('f.rst', file_stats)
+    finally:
+        stats.remove_hook(hook)
+    assert calls == [('f.rst', {'file': 2.0})]
+    summary = run_stats.to_json({'extra': 1})
+    assert summary['files'] == 1
+    assert summary['stages'] == {'file': {'seconds': 2.0, 'count': 1}}
+    assert summary['slowest_files'][0]['path'] == 'f.rst'
+    assert summary['extra'] == 1